@@ -1,3 +1,6 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
 from copy import deepcopy
 from .TokenTypes import *
 
@@ -7,9 +10,9 @@ class Literal:
         self.value = value
 
 class Location:
-    def __init__(self):
-        self.line = 0
-        self.col = 0
+    def __init__(self, line=0, col=0):
+        self.line = line
+        self.col = col
 
     def __repr__(self):
         return f"{self.line}:{self.col}"
@@ -21,21 +24,202 @@ class Location:
     def bump_col(self):
         self.col += 1
 
+_NEWLINE_RE = re.compile("\n")
+
+class LineMap:
+    """
+    Maps source offsets to `Location`s
+
+    the newline table is only built on the first lookup, so sources
+    that never produce a diagnostic never pay for it
+    """
+    def __init__(self, program):
+        self.program = program
+        self._newlines = None
+
+    def location(self, offset):
+        if self._newlines is None:
+            # the legacy lexer never bumps the line for a newline at offset 0
+            self._newlines = [m.start() for m in _NEWLINE_RE.finditer(self.program, 1)]
+        line = bisect_right(self._newlines, offset)
+        loc = Location()
+        loc.line = line
+        loc.col = offset - (self._newlines[line - 1] if line else 0)
+        return loc
+
+class OffsetLocation:
+    """
+    A `Location` that is resolved from its offset only when it's printed
+    """
+    __slots__ = ("line_map", "offset")
+
+    def __init__(self, line_map, offset):
+        self.line_map = line_map
+        self.offset = offset
+
+    @property
+    def line(self):
+        return self.line_map.location(self.offset).line
+
+    @property
+    def col(self):
+        return self.line_map.location(self.offset).col
+
+    def __repr__(self):
+        return repr(self.line_map.location(self.offset))
+
+    def __reduce__(self):
+        # pickled as the `Location` it resolves to, without the source
+        loc = self.line_map.location(self.offset)
+        return (Location, (loc.line, loc.col))
+
 class Token:
     def __init__(self, typ, value, loc=Location()):
         self.typ = typ
         self.value = value
-        self.raw = str(self.value)
         self.loc = loc
 
+    @property
+    def raw(self):
+        return str(self.value)
+
     def __repr__(self):
         return f"{self.loc}: {str(self.typ).ljust(16)}\t=> `{str(self.value)}`"
 
-class Lexer:
+_KINDS = list(TokenKind)
+_KIND_IDS = {kind: i for i, kind in enumerate(_KINDS)}
+
+class TokenStream:
+    """
+    Struct of arrays token storage
+
+    kinds, offsets and values live in parallel `array`s, values are
+    indices into a table of interned objects so every `a` or `1.0`
+    in the program shares one entry. `Token`s are only built on
+    demand when indexing or iterating the stream
+    """
     def __init__(self, program):
         self.program = program
+        self.line_map = LineMap(program)
+        self.kinds = array("B")
+        self.starts = array("L")
+        self.ends = array("L")
+        self.values = array("L")
+        self.interned = []
+        self._intern_ids = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        return Token(self.kind(i), self.value(i), self.loc(i))
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self[i]
+
+    def intern(self, value):
+        key = (value.typ, value.value) if isinstance(value, Literal) else value
+        id_ = self._intern_ids.get(key)
+        if id_ is None:
+            id_ = self._intern_ids[key] = len(self.interned)
+            self.interned.append(value)
+        return id_
+
+    def append(self, typ, value, start, end):
+        self.kinds.append(_KIND_IDS[typ])
+        self.starts.append(start)
+        self.ends.append(end)
+        self.values.append(self.intern(value))
+
+    def record(self, tokens):
+        """
+        Yields `tokens`, raw tokens like `Lexer.scan()`'s, and appends
+        them to the stream on the way, they are all in the stream once
+        `tokens` is exhausted
+        """
+        kinds, starts, ends, values = [], [], [], []
+        kind_ids = _KIND_IDS
+        intern = self.intern
+        for tok in tokens:
+            typ, value, start, end = tok
+            kinds.append(kind_ids[typ])
+            starts.append(start)
+            ends.append(end)
+            values.append(intern(value))
+            yield tok
+        self.kinds.fromlist(kinds)
+        self.starts.fromlist(starts)
+        self.ends.fromlist(ends)
+        self.values.fromlist(values)
+
+    def raw(self):
+        """
+        Yields the same `(TokenKind, value, start, end)` tuples as `Lexer.scan()`
+        """
+        kinds, starts, ends, values, interned = self.kinds, self.starts, self.ends, self.values, self.interned
+        for i in range(len(kinds)):
+            yield _KINDS[kinds[i]], interned[values[i]], starts[i], ends[i]
+
+    def kind(self, i):
+        return _KINDS[self.kinds[i]]
+
+    def value(self, i):
+        return self.interned[self.values[i]]
+
+    def loc(self, i):
+        return OffsetLocation(self.line_map, self.starts[i])
+
+    def text(self, i):
+        return self.program[self.starts[i]:self.ends[i]]
+
+def edit_range(old, new):
+    """
+    `(start, old_end, new_end)` of the one edit that turns `old` into
+    `new`, the common prefix and suffix are found by bisecting over
+    slice comparisons which run in C
+    """
+    n = min(len(old), len(new))
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    start = lo
+    # the suffix can't overlap the prefix
+    lo, hi = 0, n - start
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return start, len(old) - lo, len(new) - lo
+
+# one alternative per token class, tried in the same order as the legacy
+# `lexfile` branches, two character punctuators before single ones
+_TOKEN_RE = re.compile("|".join([
+    r"(?P<SPACE>\s+)",
+    r"(?P<COMMENT>//[^\n]*)",
+    r"(?P<NUMBER>\d[\d.]*)",
+    r"(?P<WORD>[^\W\d]\w*)",
+    "(?P<PUNCT>" + "|".join(re.escape(p) for p in sorted(Punctuators, key=len, reverse=True)) + ")",
+    r"(?P<UNKNOWN>.)",
+]), re.DOTALL)
+
+# every identifier-like word that isn't a plain `IDENT`
+_WORDS = {word: (kind, word) for word, kind in Keywords.items()}
+_WORDS.update({word: (TokenKind.TYPE, typ) for word, typ in Types.items()})
+
+class Lexer:
+    def __init__(self, program, legacy=False):
+        self.program = program
+        self.legacy = legacy
+        self.line_map = LineMap(program)
         self.id = 0
-        self.curr_char = self.program[self.id]
+        self.curr_char = self.program[self.id] if self.program else None
         self.loc = Location()
 
     def advance(self):
@@ -56,8 +240,122 @@ class Lexer:
         return buffer
 
     def lexfile(self):
+        if self.legacy:
+            yield from self.lexfile_legacy()
+            return
+
+        line_map = self.line_map
+        for typ, value, start, _ in self.scan():
+            yield Token(typ, value, OffsetLocation(line_map, start))
+
+    def tokenize(self):
+        stream = TokenStream(self.program)
+        append = stream.append
+        for typ, value, start, end in self.scan():
+            append(typ, value, start, end)
+        return stream
+
+    def scan(self, pos=0):
+        """
+        Yields `(TokenKind, value, start, end)` for every token in the program
+
+        this is the table driven lexer, it matches whole tokens
+        against slices of the program instead of walking it one
+        char at a time. `pos` must be an offset where the lexer would
+        start a match anyway, like the end of a token
+        """
+        if self.legacy:
+            for tok, start, end in self.lex_legacy():
+                yield tok.typ, tok.value, start, end
+            return
+
+        words = _WORDS
+        literals = {}
+        for m in _TOKEN_RE.finditer(self.program, pos):
+            kind = m.lastgroup
+            if kind == "WORD":
+                word = m.group()
+                if word in words:
+                    typ, value = words[word]
+                    yield typ, value, m.start(), m.end()
+                elif word == "true" or word == "false":
+                    lit = literals.get(word)
+                    if lit is None:
+                        lit = literals[word] = Literal(LiteralKind.BOOL, word)
+                    yield TokenKind.LITERAL, lit, m.start(), m.end()
+                else:
+                    yield TokenKind.IDENT, word, m.start(), m.end()
+            elif kind == "PUNCT":
+                punct = m.group()
+                yield Punctuators[punct], punct, m.start(), m.end()
+            elif kind == "NUMBER":
+                word = m.group()
+                lit = literals.get(word)
+                if lit is None:
+                    if "." in word:
+                        float(word)
+                        lit = Literal(LiteralKind.FLOAT, word)
+                    else:
+                        lit = Literal(LiteralKind.INT, word)
+                    literals[word] = lit
+                yield TokenKind.LITERAL, lit, m.start(), m.end()
+            elif kind == "UNKNOWN":
+                assert False, "unreachable"
+
+    def relex(self, old: TokenStream, start, old_end, new_end):
+        """
+        The `TokenStream` of the program, built from `old`, the stream
+        of the program before the text between `start` and `old_end` was
+        replaced by what is now between `start` and `new_end`
+
+        lexing restarts after the last token that ends before the edit
+        and stops as soon as a token starts where one of the old tokens
+        after the edit started, shifted by the edit. From there the rest
+        of the program is the same text, so it lexes the same way and
+        the old tokens are copied over instead
+        """
+        delta = new_end - old_end
+        starts, ends = old.starts, old.ends
+        keep = bisect_left(ends, start)
+        pos = ends[keep - 1] if keep else 0
+
+        stream = TokenStream(self.program)
+        stream.interned = list(old.interned)
+        stream._intern_ids = dict(old._intern_ids)
+        stream.kinds = old.kinds[:keep]
+        stream.starts = starts[:keep]
+        stream.ends = ends[:keep]
+        stream.values = old.values[:keep]
+
+        n = len(starts)
+        k = bisect_left(starts, old_end)
+        append = stream.append
+        for typ, value, s, e in self.scan(pos):
+            if s >= new_end:
+                old_s = s - delta
+                while k < n and starts[k] < old_s:
+                    k += 1
+                if k < n and starts[k] == old_s:
+                    stream.kinds.extend(old.kinds[k:])
+                    stream.values.extend(old.values[k:])
+                    if delta:
+                        stream.starts.extend(x + delta for x in starts[k:])
+                        stream.ends.extend(x + delta for x in ends[k:])
+                    else:
+                        stream.starts.extend(starts[k:])
+                        stream.ends.extend(ends[k:])
+                    return stream
+            append(typ, value, s, e)
+        return stream
+
+    def lexfile_legacy(self):
+        for tok, _, _ in self.lex_legacy():
+            yield tok
+
+    def lex_legacy(self):
         while self.curr_char != None:
             loc = deepcopy(self.loc)
+            start = self.id
             if self.curr_char.isspace():
                 self.advance()
                 continue
@@ -72,20 +370,20 @@ class Lexer:
                     typ = LiteralKind.FLOAT
 
                 lit = Literal(typ, str(word))
-                yield Token(TokenKind.LITERAL, lit, loc)
+                yield Token(TokenKind.LITERAL, lit, loc), start, self.id
 
             elif self.curr_char.isalpha() or self.curr_char == "_":
                 word = self.lex_word(lambda self: self.curr_char.isalnum() or self.curr_char == "_")
 
                 if word in Keywords:
-                    yield Token(Keywords[word], word, loc)
+                    yield Token(Keywords[word], word, loc), start, self.id
                 elif word in Types:
-                    yield Token(TokenKind.TYPE, Types[word], loc)
+                    yield Token(TokenKind.TYPE, Types[word], loc), start, self.id
                 elif word in {'true', 'false'}:
                     lit = Literal(LiteralKind.BOOL, word)
-                    yield Token(TokenKind.LITERAL, lit, loc)
+                    yield Token(TokenKind.LITERAL, lit, loc), start, self.id
                 else:
-                    yield Token(TokenKind.IDENT, word, loc)
+                    yield Token(TokenKind.IDENT, word, loc), start, self.id
 
             elif self.curr_char in Punctuators:
                 prev = self.curr_char
@@ -97,10 +395,10 @@ class Lexer:
                     continue
 
                 if compound in Punctuators:
-                    yield Token(Punctuators[compound], compound, loc)
+                    yield Token(Punctuators[compound], compound, loc), start, self.id + 1
                     self.advance()
                 else:
-                    yield Token(Punctuators[prev], prev, loc)
+                    yield Token(Punctuators[prev], prev, loc), start, self.id
 
             else:
                 assert False, "unreachable"
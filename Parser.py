@@ -1,64 +1,121 @@
-from .Lexer import TokenKind, Token
+from collections import deque
+
+from .Lexer import TokenKind, Token, TokenStream, OffsetLocation
 from .ast import *
 
+_EOF = (TokenKind.EOF, None, -1, -1)
+
+# binding power of every binary operator, higher binds tighter
+BINDING_POWER = {
+    TokenKind.EQ        : 1,
+    TokenKind.PIPE2     : 2,
+    TokenKind.AMPERSAND2: 3,
+    TokenKind.PIPE      : 4,
+    TokenKind.AMPERSAND : 5,
+    TokenKind.EQ2       : 6,
+    TokenKind.BANGEQ    : 6,
+    TokenKind.LT        : 7,
+    TokenKind.GT        : 7,
+    TokenKind.LT2       : 8,
+    TokenKind.GT2       : 8,
+    TokenKind.PLUS      : 9,
+    TokenKind.MINUS     : 9,
+    TokenKind.STAR      : 10,
+    TokenKind.SLASH     : 10,
+    TokenKind.PERCENT   : 10,
+}
+
+# calls nest through `Parser.expression()` recursively, and deeper than
+# this they'd get near the interpreter's recursion limit
+MAX_CALL_DEPTH = 200
+
+# what `Parser.expression()` keeps on its stack
+_PREFIX, _PAREN, _BINARY = range(3)
+
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.id = 0
-        self.curr_tok = self.tokens[self.id]
+    # number of tokens buffered past the current one, `peek()` never
+    # needs more than one
+    LOOKAHEAD = 1
+
+    def __init__(self, tokens, line_map=None):
+        """
+        `tokens` is either a `TokenStream` or any iterator of
+        `(TokenKind, value, start, end)` such as `Lexer.scan()`,
+        tokens are pulled one at a time so the lexer only ever runs
+        `LOOKAHEAD` tokens ahead of the parser
+        """
+        if isinstance(tokens, TokenStream):
+            line_map = tokens.line_map
+            tokens = tokens.raw()
+        self.tokens = iter(tokens)
+        self.line_map = line_map
+        self.ahead = deque(maxlen=self.LOOKAHEAD)
+        self.advance()
 
         self.state = True
+        # what `error()` reported
+        self.message = None
+        # calls being parsed
+        self.depth = 0
 
     def advance(self):
-        if self.id < len(self.tokens) - 1:
-            self.id += 1
-            self.curr_tok = self.tokens[self.id]
+        if self.ahead:
+            tok = self.ahead.popleft()
         else:
-            self.curr_tok = Token(TokenKind.EOF, None)
+            tok = next(self.tokens, _EOF)
+        self.typ, self.value, self.start, self.end = tok
+
+    @property
+    def curr_tok(self):
+        if self.line_map is None or self.start < 0:
+            return Token(self.typ, self.value)
+        return Token(self.typ, self.value, OffsetLocation(self.line_map, self.start))
 
     def error(self, msg):
         self.state = False
-        print(f"{self.curr_tok.loc}: {msg}")
+        message = f"{self.curr_tok.loc}: {msg}"
+        # the first error is the one to report, the rest follow from it
+        self.message = self.message or message
+        print(message)
 
     @property
     def keepParsing(self):
-        return self.curr_tok != TokenKind.EOF and self.state
+        return self.typ != TokenKind.EOF and self.state
 
     def peek(self):
-        if self.id < len(self.tokens) - 1:
-            return self.tokens[self.id + 1]
-        else:
-            return Token(TokenKind.EOF, None)
+        if not self.ahead:
+            self.ahead.append(next(self.tokens, _EOF))
+        return self.ahead[0][0]
 
     def expect(self, typ):
         self.advance()
-        if self.curr_tok.typ != typ:
-            self.error(f"Expected `{typ}` but got `{self.curr_tok.typ}` ({self.curr_tok.value})")
-        return self.curr_tok
+        if self.typ != typ:
+            self.error(f"Expected `{typ}` but got `{self.typ}` ({self.value})")
+        return self.value
 
     def expect_curr(self, typ):
-        tok = self.curr_tok
-        if tok.typ != typ:
-            self.error(f"Expected `{typ}` but got `{tok.typ}` ({tok.value})")
+        value = self.value
+        if self.typ != typ:
+            self.error(f"Expected `{typ}` but got `{self.typ}` ({value})")
         self.advance()
-        return tok
+        return value
 
     def func_arg(self):
         """
         Parses only one function arg in a function signature
         """
         prop = None
-        if self.curr_tok.typ not in {TokenKind.IN, TokenKind.OUT, TokenKind.INOUT, TokenKind.TYPE}:
-            self.error(f"Expected `in`, `out`, `inout`, or a type but got `{self.curr_tok.value}`")
+        if self.typ not in {TokenKind.IN, TokenKind.OUT, TokenKind.INOUT, TokenKind.TYPE}:
+            self.error(f"Expected `in`, `out`, `inout`, or a type but got `{self.value}`")
             return
 
-        if self.curr_tok.typ == TokenKind.TYPE:
-            typ = self.curr_tok.value
+        if self.typ == TokenKind.TYPE:
+            typ = self.value
         else:
-            prop = self.curr_tok.typ
-            typ = self.expect(TokenKind.TYPE).value
+            prop = self.typ
+            typ = self.expect(TokenKind.TYPE)
 
-        name = self.expect(TokenKind.IDENT).value
+        name = self.expect(TokenKind.IDENT)
         self.advance()
         return FnArg(name, typ, prop)
 
@@ -71,18 +128,18 @@ class Parser:
         """
         self.advance()
         args = []
-        while self.keepParsing and self.curr_tok.typ != TokenKind.RPAREN:
+        while self.keepParsing and self.typ != TokenKind.RPAREN:
             args.append(self.func_arg())
-            if self.curr_tok.typ == TokenKind.RPAREN:
+            if self.typ == TokenKind.RPAREN:
                 break
-            elif self.curr_tok.typ == TokenKind.COMMA:
+            elif self.typ == TokenKind.COMMA:
                 self.advance()
         self.advance()
         return args
 
     def block(self):
         self.expect_curr(TokenKind.LCURLY)
-        while self.keepParsing and self.curr_tok.typ != TokenKind.RCURLY:
+        while self.keepParsing and self.typ != TokenKind.RCURLY:
             yield from self.statement()
         self.expect_curr(TokenKind.RCURLY)
 
@@ -101,22 +158,23 @@ class Parser:
 
         either way the type is followed by an identifier
         """
-        typ = self.curr_tok.value
+        typ = self.value
         self.advance()
-        if self.curr_tok.typ == TokenKind.IDENT:
+        if self.typ == TokenKind.IDENT:
             # it could be 1, 2 or 3
-            ident = self.curr_tok.value
-            next_ = self.peek()
-            if next_.typ == TokenKind.LPAREN:
+            ident = self.value
+            if self.peek() == TokenKind.LPAREN:
                 # it's a function definition
                 self.advance()
                 args = self.func_args()
                 fn_sig = FnSig(ident, args, typ)
                 body = list(self.block())
                 yield FnDef(fn_sig, body)
+                # `block()` already consumed the closing `}`
+                return
             else:
                 yield Decl(typ, self.declaration())
-        elif self.curr_tok.typ == TokenKind.LPAREN:
+        elif self.typ == TokenKind.LPAREN:
             # it's 4
             # this function expects an identifier so L
             return self.fn_call()
@@ -125,91 +183,121 @@ class Parser:
             pass
         self.advance()
 
-    def compound(self, tok_list, callback):
-        left = callback()
-        while self.keepParsing and self.curr_tok.typ in tok_list:
-            op = self.curr_tok
-            self.advance()
-            right = callback()
-            left = Binary(op, left, right)
-
-        return left
-
     def assignment_expr(self):
-        ident = self.expect_curr(TokenKind.IDENT).value
+        ident = self.expect_curr(TokenKind.IDENT)
         self.expect_curr(TokenKind.EQ)
         init = self.expression()
         return Assign(ident, init)
 
     def fn_call(self):
-        name = self.expect_curr(TokenKind.IDENT).value
+        if self.typ == TokenKind.TYPE:
+            # a constructor like `vec3(...)`, named after its type
+            name = self.value.name.lower()
+            self.advance()
+        else:
+            name = self.expect_curr(TokenKind.IDENT)
         self.expect_curr(TokenKind.LPAREN)
         args = []
-        while self.keepParsing and self.curr_tok.typ != TokenKind.RPAREN:
+        if self.depth == MAX_CALL_DEPTH:
+            self.error(f"Calls nested more than {MAX_CALL_DEPTH} deep")
+            return Call(name, args)
+        self.depth += 1
+        while self.keepParsing and self.typ != TokenKind.RPAREN:
             args.append(self.expression())
-            if self.curr_tok.typ == TokenKind.RPAREN:
+            if self.typ == TokenKind.RPAREN:
                 break
             self.expect_curr(TokenKind.COMMA)
+        self.depth -= 1
         self.expect_curr(TokenKind.RPAREN)
         return Call(name, args)
 
     def primary(self):
-        if self.curr_tok.typ == TokenKind.IDENT:
-            next_ = self.peek()
-            if next_.typ == TokenKind.LPAREN:
+        if self.typ == TokenKind.IDENT:
+            if self.peek() == TokenKind.LPAREN:
                 return self.fn_call()
             else:
-                curr = self.curr_tok
-                self.advance()
-                return Ident(curr.value)
-        elif self.curr_tok.typ == TokenKind.LITERAL:
-            return self.expect_curr(TokenKind.LITERAL).value
-
-    def unary(self):
-        if self.curr_tok.typ in [TokenKind.MINUS, TokenKind.BANG]:
-            op = self.curr_tok
-            self.advance()
-            right = self.unary()
-            return Unary(op, right)
-
-        return self.primary()
-
-    def factor(self):
-        return self.compound([TokenKind.STAR, TokenKind.SLASH], self.unary)
-
-    def term(self):
-        return self.compound([TokenKind.PLUS, TokenKind.MINUS], self.factor)
+                return Ident(self.expect_curr(TokenKind.IDENT))
+        elif self.typ == TokenKind.LITERAL:
+            return self.expect_curr(TokenKind.LITERAL)
+        elif self.typ == TokenKind.TYPE and self.peek() == TokenKind.LPAREN:
+            return self.fn_call()
+        else:
+            self.error(f"Expected an expression but got `{self.value}`")
 
-    def comparison(self):
-        return self.compound([TokenKind.LT, TokenKind.GT], self.term)
+    def expression(self, min_bp=0):
+        """
+        Precedence climbing over `BINDING_POWER`
+
+        operators that bind tighter than `min_bp` are folded into
+        `left` by the inner loop, so chains like `a + b + c` don't grow
+        anything and a plain literal or identifier is parsed in a single
+        step. Whatever still waits for its operand, a prefix operator,
+        an open `(` or the left side of a binary operator, is kept on an
+        explicit stack rather than in recursive calls, so no nesting
+        depth overflows the interpreter's
+        """
+        # (PREFIX, op) | (PAREN, min_bp outside) | (BINARY, op, left, min_bp before)
+        stack = []
+        while True:
+            while self.typ in {TokenKind.MINUS, TokenKind.BANG, TokenKind.LPAREN}:
+                if self.typ == TokenKind.LPAREN:
+                    stack.append((_PAREN, min_bp))
+                    min_bp = 0
+                else:
+                    stack.append((_PREFIX, self.curr_tok))
+                self.advance()
 
-    def assign(self):
-        left = self.comparison()
-        if self.curr_tok.typ == TokenKind.EQ:
-            self.advance()
-            init = self.assign()
-            if isinstance(left, Ident):
-                return Assign(left.name, init)
+            if self.typ == TokenKind.LITERAL:
+                left = self.value
+                self.advance()
+            elif self.typ == TokenKind.IDENT and self.peek() != TokenKind.LPAREN:
+                left = Ident(self.value)
+                self.advance()
             else:
-                self.error(f"Assignment expression expected `Ident` but got `{left}`")
-        return left
-
-    def expression(self):
-        return self.compound([TokenKind.BANGEQ, TokenKind.EQ2], self.assign)
+                left = self.primary()
+
+            while True:
+                # prefix operators only apply to the operand right after them
+                while stack and stack[-1][0] == _PREFIX:
+                    left = Unary(stack.pop()[1], left)
+                bp = BINDING_POWER.get(self.typ)
+                if bp is not None and bp > min_bp and self.state:
+                    op = self.curr_tok
+                    self.advance()
+                    stack.append((_BINARY, op, left, min_bp))
+                    # `=` is right associative, `a = b = c` is `a = (b = c)`
+                    min_bp = bp - 1 if op.typ == TokenKind.EQ else bp
+                    break
+                if not stack:
+                    return left
+                frame = stack.pop()
+                if frame[0] == _PAREN:
+                    self.expect_curr(TokenKind.RPAREN)
+                    min_bp = frame[1]
+                    continue
+                _, op, lhs, min_bp = frame
+                if op.typ != TokenKind.EQ:
+                    left = Binary(op, lhs, left)
+                elif isinstance(lhs, Ident):
+                    left = Assign(lhs.name, left)
+                else:
+                    self.error(f"Assignment expression expected `Ident` but got `{lhs}`")
 
     def expr_stmt(self):
         while self.keepParsing and True:
             yield self.expression()
-            if self.curr_tok.typ == TokenKind.SEMI:
+            if self.typ == TokenKind.SEMI:
                 break
-            elif self.curr_tok.typ == TokenKind.COMMA:
+            elif self.typ == TokenKind.COMMA:
                 self.advance()
+            else:
+                self.error(f"Expected `;` but got `{self.value}`")
         self.expect_curr(TokenKind.SEMI)
 
     def statement(self):
-        if self.curr_tok.typ in {TokenKind.IDENT, TokenKind.LITERAL}:
+        if self.typ in {TokenKind.IDENT, TokenKind.LITERAL}:
             yield from self.expr_stmt()
-        elif self.curr_tok.typ == TokenKind.TYPE:
+        elif self.typ == TokenKind.TYPE:
             yield from self.item()
         else:
             # Should hit this for EOF in some cases
@@ -217,5 +305,13 @@ class Parser:
             return
 
     def parse(self):
+        """
+        Yields the top level items, the item an error was found in is
+        never yielded and the error is raised instead
+        """
         while self.keepParsing:
-            yield from self.statement()
+            for node in self.statement():
+                if not self.state:
+                    break
+                yield node
+        assert self.state, self.message
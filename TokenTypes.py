@@ -34,6 +34,10 @@ class LiteralKind(Enum):
     BOOL = auto()
 
 class TokenKind(Enum):
+    # members are singletons, hashing by identity keeps the parser's
+    # table lookups in C instead of going through `Enum.__hash__`
+    __hash__ = object.__hash__
+
     LITERAL     = auto()
     INTRINSIC   = auto()
     IDENT       = auto()
@@ -0,0 +1,153 @@
+from .graph import Graph
+
+class BpyApplier:
+    """
+    Materializes `graph.Graph`s as Blender node trees
+
+    an existing tree is reconciled with the graph instead of rebuilt,
+    nodes are matched by name, which codegen keeps stable between
+    compiles, and only what changed is added, removed, relinked or set.
+    Leaving the rest alone means Blender doesn't have to recompile the
+    whole material for a small edit. Works the same against `bpy` and
+    `fake_bpy`
+    """
+    def __init__(self, bpy):
+        self.bpy = bpy
+        # what the last `apply()` calls changed, for reporting
+        self.changes = {
+            "nodes added": 0,
+            "nodes removed": 0,
+            "nodes updated": 0,
+            "links added": 0,
+            "links removed": 0,
+        }
+
+    def new_socket(self, node_tree, in_out, name, socket_type):
+        if hasattr(node_tree, "interface"):
+            # Blender 4.0+
+            return node_tree.interface.new_socket(name=name, in_out=in_out, socket_type=socket_type)
+        sockets = node_tree.inputs if in_out == "INPUT" else node_tree.outputs
+        return sockets.new(type=socket_type, name=name)
+
+    def interface(self, node_tree):
+        """
+        The (name, socket type) of the group inputs and outputs
+        """
+        if hasattr(node_tree, "interface"):
+            items = [s for s in node_tree.interface.items_tree if s.item_type == "SOCKET"]
+            return (
+                [(s.name, s.socket_type) for s in items if s.in_out == "INPUT"],
+                [(s.name, s.socket_type) for s in items if s.in_out == "OUTPUT"])
+        return (
+            [(s.name, s.bl_socket_idname) for s in node_tree.inputs],
+            [(s.name, s.bl_socket_idname) for s in node_tree.outputs])
+
+    def clear_interface(self, node_tree):
+        if hasattr(node_tree, "interface"):
+            node_tree.interface.clear()
+        else:
+            node_tree.inputs.clear()
+            node_tree.outputs.clear()
+
+    def apply(self, graph: Graph, node_tree=None):
+        """
+        Makes `node_tree` match `graph`, for function graphs the node
+        group of the same name is reused or created. Returns the node tree
+        """
+        if node_tree is None:
+            node_tree = self.bpy.data.node_groups.get(graph.name)
+            if node_tree is None or node_tree.bl_idname != graph.tree_type:
+                node_tree = self.bpy.data.node_groups.new(type=graph.tree_type, name=graph.name)
+
+        if graph.is_group and self.interface(node_tree) != (graph.inputs, graph.outputs):
+            self.clear_interface(node_tree)
+            for name, socket_type in graph.inputs:
+                self.new_socket(node_tree, "INPUT", name, socket_type)
+            for name, socket_type in graph.outputs:
+                self.new_socket(node_tree, "OUTPUT", name, socket_type)
+
+        bl_nodes = self.sync_nodes(graph, node_tree)
+        self.sync_links(graph, node_tree, bl_nodes)
+        return node_tree
+
+    def sync_nodes(self, graph, node_tree):
+        """
+        Returns graph node => Blender node
+        """
+        nodes = node_tree.nodes
+        existing = {}
+        # stale nodes go first so their names are free again
+        for bl_node in list(nodes):
+            node = graph.nodes.get(bl_node.name)
+            if node is not None and node.bl_idname == bl_node.bl_idname:
+                existing[node.name] = bl_node
+            else:
+                nodes.remove(bl_node)
+                self.changes["nodes removed"] += 1
+
+        bl_nodes = {}
+        for node in graph.nodes.values():
+            bl_node = existing.get(node.name)
+            if bl_node is None:
+                bl_node = nodes.new(type=node.bl_idname)
+                bl_node.name = node.name
+                self.sync_node(node, bl_node)
+                self.changes["nodes added"] += 1
+            elif self.sync_node(node, bl_node):
+                self.changes["nodes updated"] += 1
+            bl_nodes[node] = bl_node
+        return bl_nodes
+
+    def sync_node(self, node, bl_node):
+        """
+        Sets whatever differs on `bl_node`, returns True if that
+        changes what the node computes
+        """
+        changed = False
+        if bl_node.label != node.label:
+            bl_node.label = node.label
+        if tuple(bl_node.location) != tuple(node.location):
+            bl_node.location = node.location
+        for prop, value in node.props.items():
+            if prop == "node_tree":
+                # group nodes name the group they instance, it has to be
+                # applied before them
+                value = self.bpy.data.node_groups.get(value)
+            if getattr(bl_node, prop, None) != value:
+                setattr(bl_node, prop, value)
+                changed = True
+        if node.defaults:
+            inputs = bl_node.inputs
+            for key, value in node.defaults.items():
+                socket = inputs[key]
+                if socket.default_value != value:
+                    socket.default_value = value
+                    changed = True
+        if node.output_defaults:
+            outputs = bl_node.outputs
+            for key, value in node.output_defaults.items():
+                socket = outputs[key]
+                if socket.default_value != value:
+                    socket.default_value = value
+                    changed = True
+        return changed
+
+    def sync_links(self, graph, node_tree, bl_nodes):
+        links = node_tree.links
+        # an input socket takes a single link
+        existing = {link.to_socket: link for link in links}
+        for link in graph.links.values():
+            from_socket = link.from_socket
+            bl_from = bl_nodes[from_socket.node].outputs[from_socket.key]
+            bl_to = bl_nodes[link.to_node].inputs[link.to_key]
+            bl_link = existing.pop(bl_to, None)
+            if bl_link is not None:
+                if bl_link.from_socket == bl_from:
+                    continue
+                links.remove(bl_link)
+                self.changes["links removed"] += 1
+            links.new(bl_from, bl_to)
+            self.changes["links added"] += 1
+        for bl_link in existing.values():
+            links.remove(bl_link)
+            self.changes["links removed"] += 1
@@ -0,0 +1,304 @@
+"""
+Binary node graph artifacts
+
+    header   MAGIC, u16 VERSION
+    graphs   one record per graph, written as they are generated
+    index    u32 count, then (name, u64 offset, u32 size) per graph,
+             the top level tree is named `TREE` in it
+    footer   u64 offset of the index
+
+every string in a record is an index into the record's string table,
+stored as one NUL separated string,
+so names like `ShaderNodeMath` or `MULTIPLY` are stored once per graph.
+Records only refer to their own table, any one of them can be read and
+built without touching the rest of the file
+"""
+
+import struct
+
+from .graph import Graph, Node, Socket, Link
+
+MAGIC = b"GLNG"
+VERSION = 2
+
+# index name of the top level tree, it's named after the source file
+# and that may well be the name of one of its groups. No group can have
+# an empty name
+TREE = ""
+
+_HEADER = struct.Struct("<4sH")
+_FOOTER = struct.Struct("<Q")
+_INDEX_ENTRY = struct.Struct("<QI")
+_U32 = struct.Struct("<I")
+_SOCKET = struct.Struct("<II")
+# name, bl_idname, label, x, y, props, defaults, output defaults
+_NODE = struct.Struct("<IIIffHHH")
+# key, value type
+_VALUE = struct.Struct("<IB")
+_LINK = struct.Struct("<IIII")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+
+# value types, a vector is `_VECTOR + len(vector)`
+_T_STR, _T_FLOAT, _T_INT, _T_BOOL, _VECTOR = range(5)
+
+# marks a socket key that is a string table index rather than a socket index
+_NAMED = 0x80000000
+
+class ArtifactError(Exception):
+    pass
+
+def _pack_str(s):
+    data = s.encode()
+    return _U32.pack(len(data)) + data
+
+def _unpack_str(buf, pos):
+    n, = _U32.unpack_from(buf, pos)
+    pos += 4
+    return str(buf[pos:pos + n], "utf-8"), pos + n
+
+class _Strings:
+    def __init__(self):
+        self.ids = {}
+
+    def __call__(self, s):
+        id_ = self.ids.get(s)
+        if id_ is None:
+            id_ = self.ids[s] = len(self.ids)
+        return id_
+
+    def key(self, key):
+        return self(key) | _NAMED if isinstance(key, str) else key
+
+def _pack_value(key, value, strings):
+    if isinstance(value, str):
+        return _VALUE.pack(key, _T_STR) + _U32.pack(strings(value))
+    if isinstance(value, bool):
+        return _VALUE.pack(key, _T_BOOL) + _U32.pack(value)
+    if isinstance(value, int):
+        return _VALUE.pack(key, _T_INT) + _INT.pack(value)
+    if isinstance(value, float):
+        return _VALUE.pack(key, _T_FLOAT) + _FLOAT.pack(value)
+    # vectors and colors
+    return _VALUE.pack(key, _VECTOR + len(value)) + struct.pack(f"<{len(value)}d", *value)
+
+def _unpack_value(buf, pos, strings):
+    key, tag = _VALUE.unpack_from(buf, pos)
+    pos += _VALUE.size
+    if tag == _T_STR:
+        return key, strings[_U32.unpack_from(buf, pos)[0]], pos + 4
+    if tag == _T_BOOL:
+        return key, bool(_U32.unpack_from(buf, pos)[0]), pos + 4
+    if tag == _T_INT:
+        return key, _INT.unpack_from(buf, pos)[0], pos + 8
+    if tag == _T_FLOAT:
+        return key, _FLOAT.unpack_from(buf, pos)[0], pos + 8
+    n = tag - _VECTOR
+    return key, struct.unpack_from(f"<{n}d", buf, pos), pos + 8 * n
+
+def encode_graph(graph: Graph):
+    strings = _Strings()
+    body = []
+    body.append(_U32.pack(len(graph.inputs)))
+    body.extend(_SOCKET.pack(strings(name), strings(typ)) for name, typ in graph.inputs)
+    body.append(_U32.pack(len(graph.outputs)))
+    body.extend(_SOCKET.pack(strings(name), strings(typ)) for name, typ in graph.outputs)
+
+    index = {}
+    body.append(_U32.pack(len(graph.nodes)))
+    for i, node in enumerate(graph.nodes.values()):
+        index[node] = i
+        x, y = node.location
+        body.append(_NODE.pack(
+            strings(node.name), strings(node.bl_idname), strings(node.label), x, y,
+            len(node.props), len(node.defaults), len(node.output_defaults)))
+        body.extend(_pack_value(strings(prop), value, strings) for prop, value in node.props.items())
+        body.extend(_pack_value(strings.key(key), value, strings) for key, value in node.defaults.items())
+        body.extend(_pack_value(strings.key(key), value, strings) for key, value in node.output_defaults.items())
+
+    body.append(_U32.pack(len(graph.links)))
+    body.extend(_LINK.pack(
+        index[link.from_socket.node], strings.key(link.from_socket.key),
+        index[link.to_node], strings.key(link.to_key)) for link in graph.links.values())
+
+    head = [_pack_str(graph.name), _pack_str(graph.tree_type), bytes([graph.is_group]), _pack_str("\0".join(strings.ids))]
+    return b"".join(head + body)
+
+def decode_graph(buf):
+    buf = memoryview(buf)
+    name, pos = _unpack_str(buf, 0)
+    tree_type, pos = _unpack_str(buf, pos)
+    graph = Graph(name, tree_type, bool(buf[pos]))
+    pos += 1
+    strings, pos = _unpack_str(buf, pos)
+    strings = strings.split("\0")
+
+    def key(k):
+        return strings[k & ~_NAMED] if k & _NAMED else k
+
+    for sockets in (graph.inputs, graph.outputs):
+        n, = _U32.unpack_from(buf, pos)
+        pos += 4
+        end = pos + n * _SOCKET.size
+        sockets.extend((strings[a], strings[b]) for a, b in _SOCKET.iter_unpack(buf[pos:end]))
+        pos = end
+
+    n, = _U32.unpack_from(buf, pos)
+    pos += 4
+    nodes = []
+    for i in range(n):
+        name, idname, label, x, y, props, defaults, output_defaults = _NODE.unpack_from(buf, pos)
+        pos += _NODE.size
+        node = Node(strings[name], strings[idname], i)
+        node.label = strings[label]
+        node.location = [x, y]
+        for _ in range(props):
+            prop, value, pos = _unpack_value(buf, pos, strings)
+            node.props[strings[prop]] = value
+        for values, count in ((node.defaults, defaults), (node.output_defaults, output_defaults)):
+            for _ in range(count):
+                k, value, pos = _unpack_value(buf, pos, strings)
+                values[key(k)] = value
+        graph.nodes[node.name] = node
+        nodes.append(node)
+
+    n, = _U32.unpack_from(buf, pos)
+    pos += 4
+    end = pos + n * _LINK.size
+    links = graph.links
+    for from_node, from_key, to_node, to_key in _LINK.iter_unpack(buf[pos:end]):
+        to_node = nodes[to_node]
+        to_key = key(to_key)
+        links[(to_node, to_key)] = Link(Socket(nodes[from_node], key(from_key)), to_node, to_key)
+    return graph
+
+class ArtifactWriter:
+    """
+    Streams graphs into a binary artifact, the index is written by
+    `close()`
+
+        with ArtifactWriter(open(path, "wb")) as writer:
+            for graph in graphs:
+                writer.write(graph)
+    """
+    def __init__(self, f):
+        self.f = f
+        self.index = []
+        self.offset = f.write(_HEADER.pack(MAGIC, VERSION))
+
+    def write(self, graph: Graph):
+        record = encode_graph(graph)
+        self.index.append((graph.name if graph.is_group else TREE, self.offset, len(record)))
+        self.offset += self.f.write(record)
+
+    def close(self):
+        index = [_U32.pack(len(self.index))]
+        for name, offset, size in self.index:
+            index.append(_pack_str(name) + _INDEX_ENTRY.pack(offset, size))
+        self.f.write(b"".join(index) + _FOOTER.pack(self.offset))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, *exc):
+        if typ is None:
+            self.close()
+        else:
+            # no index, nothing can mistake what was written for an artifact
+            self.f.close()
+
+class ArtifactReader:
+    """
+    Reads the index of an artifact up front and single graphs on demand,
+    so opening a big library only costs what is actually used
+    """
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        magic, version = _HEADER.unpack(self.f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ArtifactError(f"{path} is not a node graph artifact")
+        if version != VERSION:
+            raise ArtifactError(f"{path} has version {version}, expected {VERSION}")
+        self.f.seek(-_FOOTER.size, 2)
+        end = self.f.tell()
+        offset, = _FOOTER.unpack(self.f.read(_FOOTER.size))
+        self.f.seek(offset)
+        buf = memoryview(self.f.read(end - offset))
+        n, = _U32.unpack_from(buf, 0)
+        pos = 4
+        # name => (offset, size), the top level tree is `TREE`
+        self.index = {}
+        for _ in range(n):
+            name, pos = _unpack_str(buf, pos)
+            self.index[name] = _INDEX_ENTRY.unpack_from(buf, pos)
+            pos += _INDEX_ENTRY.size
+
+    def names(self):
+        """
+        The names of the groups
+        """
+        return [name for name in self.index if name != TREE]
+
+    def load(self, name):
+        offset, size = self.index[name]
+        self.f.seek(offset)
+        return decode_graph(self.f.read(size))
+
+    def load_with_dependencies(self, names):
+        """
+        Yields the graphs of `names` and of every group they instance,
+        dependencies first
+        """
+        loaded = set()
+        for name in names:
+            stack = [(name, False)]
+            while stack:
+                name, ready = stack.pop()
+                if name in loaded:
+                    continue
+                graph = self.load(name)
+                deps = [n.props["node_tree"] for n in graph.nodes.values()
+                        if "node_tree" in n.props and n.props["node_tree"] in self.index]
+                pending = [dep for dep in deps if dep not in loaded]
+                if ready or not pending:
+                    loaded.add(name)
+                    yield graph
+                else:
+                    stack.append((name, True))
+                    stack.extend((dep, False) for dep in pending)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_artifact(path, graphs):
+    with ArtifactWriter(open(path, "wb")) as writer:
+        for graph in graphs:
+            writer.write(graph)
+
+def load_artifact(bpy, path, names=None, node_tree=None):
+    """
+    Builds the node groups `names`, all of them by default, and the ones
+    they depend on from the artifact at `path`, the top level graph goes
+    into `node_tree` if it's given. Returns the names of the graphs built
+    """
+    from .apply import BpyApplier
+    applier = BpyApplier(bpy)
+    built = []
+    with ArtifactReader(path) as reader:
+        names = list(names or reader.names())
+        if node_tree is not None and TREE in reader.index:
+            names.append(TREE)
+        for graph in reader.load_with_dependencies(names):
+            if graph.is_group:
+                applier.apply(graph)
+            else:
+                applier.apply(graph, node_tree)
+            built.append(graph.name)
+    return built
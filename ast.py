@@ -46,3 +46,12 @@ class Call:
         self.name = name
         self.args = args
 
+
+class MathOp:
+    """
+    A single Blender Math node operation, like `MULTIPLY_ADD`,
+    picked by the simplifier when it beats the plain `Binary` tree
+    """
+    def __init__(self, operation, args):
+        self.operation = operation
+        self.args = args
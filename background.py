@@ -0,0 +1,74 @@
+import queue
+import threading
+
+from .incremental import IncrementalCompiler
+
+class CompileJob:
+    """
+    Runs the front end and codegen of one compile in a worker thread
+
+    nothing here touches `bpy`, finished graphs are put on `graphs` for
+    the main thread to apply. The job works on a copy of `compiler`'s
+    functions, only once every graph has been applied should
+    `self.compiler` replace it, so a cancelled or stale job never leaves
+    it out of sync with the node groups
+    """
+    def __init__(self, compiler: IncrementalCompiler, content, tree_name, tree_type, dump_tokens=None, **kwargs):
+        self.compiler = IncrementalCompiler(compiler.cache)
+        self.compiler.functions = dict(compiler.functions)
+        self.compiler.stream = compiler.stream
+        self.compiler.options = compiler.options
+        self.content = content
+        self.tree_name = tree_name
+        self.tree_type = tree_type
+        self.dump_tokens = dump_tokens
+        self.kwargs = kwargs
+
+        self.graphs = queue.Queue()
+        self.cancelled = False
+        self.done = False
+        self.error = None
+        # end of the last token lexed
+        self.offset = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def progress(self):
+        """
+        How much of the source went through the front end, from 0 to 1
+        """
+        return self.offset / max(len(self.content), 1)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def track(self, tokens, line_map):
+        for tok in tokens:
+            if self.cancelled:
+                # the parser sees the end of the file and winds down
+                return
+            self.offset = tok[3]
+            yield tok
+
+    def tokens(self, tokens, line_map):
+        tokens = self.track(tokens, line_map)
+        if self.dump_tokens:
+            tokens = self.dump_tokens(tokens, line_map)
+        return tokens
+
+    def run(self):
+        try:
+            graphs = self.compiler.generate(
+                self.content, self.tree_name, self.tree_type,
+                dump_tokens=self.tokens, **self.kwargs)
+            for graph in graphs:
+                if self.cancelled:
+                    break
+                self.graphs.put(graph)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
@@ -0,0 +1,6 @@
+"""
+Compiler benchmarks, run them with `python -m glsl_compiler.bench`
+"""
+
+from .synth import Synth, generate_source
+from .harness import run, compare, scaling, nonlinear, save, load
@@ -0,0 +1,80 @@
+import argparse
+import sys
+
+from .synth import Synth
+from .harness import BENCH_VERSION, PHASES, run, compare, scaling, nonlinear, save, load
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m glsl_compiler.bench",
+        description="Times each compiler phase on synthetic GLSL")
+    group = parser.add_argument_group("source")
+    group.add_argument("--seed", type=int, default=0)
+    group.add_argument("--functions", type=int, default=20)
+    group.add_argument("--depth", type=int, default=2, help="parenthesized levels per expression")
+    group.add_argument("--width", type=int, default=4, help="operands per level")
+    group.add_argument("--decls", type=int, default=8, help="local declarations per function")
+    group.add_argument("--globals", type=int, default=4)
+    group.add_argument("--literals", type=float, default=0.3, help="chance that an operand is a literal")
+    parser.add_argument("--phases", nargs="+", choices=list(PHASES), default=list(PHASES))
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per phase, the fastest counts")
+    parser.add_argument("--save", metavar="BASELINE", help="write the results to a JSON baseline")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="rerun a baseline's settings and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown that counts as a regression (default: %(default)s)")
+    parser.add_argument("--scaling", action="store_true",
+                        help="check that time per token stays flat with 10x and 100x the functions")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="growth in time per token that counts as nonlinear (default: %(default)s)")
+    parser.add_argument("--dump-source", metavar="FILE", help="write the generated source and exit")
+    return parser.parse_args(argv)
+
+def print_result(result):
+    counts = result["counts"]
+    print(", ".join(f"{v} {k}" for k, v in counts.items()))
+    for phase, r in result["phases"].items():
+        peak = f"{r['peak_bytes'] / 1024 / 1024:8.1f} MiB peak" if r["peak_bytes"] is not None else ""
+        rate = f"  {r['tokens_per_sec']:,.0f} tokens/s" if "tokens_per_sec" in r else ""
+        print(f"{phase:<10}{r['seconds'] * 1000:10.1f}ms {peak}{rate}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = {k: getattr(args, k) for k in ("seed", "functions", "depth", "width", "decls", "globals", "literals")}
+
+    if args.dump_source:
+        with open(args.dump_source, "w") as f:
+            f.write(Synth(**settings).source())
+        return 0
+
+    status = 0
+    if args.scaling:
+        per_token = scaling(settings, phases=args.phases)
+        for factor, phases in per_token.items():
+            print(f"{factor:>4}x  " + "  ".join(f"{p} {s * 1e6:.2f}us" for p, s in phases.items()) + "  per token")
+        for phase, factor, ratio in nonlinear(per_token, args.tolerance):
+            print(f"NONLINEAR {phase}: {ratio:.2f}x the time per token at {factor}x the input")
+            status = 1
+        return status
+
+    baseline = None
+    if args.compare:
+        baseline = load(args.compare)
+        if baseline["version"] != BENCH_VERSION:
+            print(f"{args.compare} was written by benchmark version {baseline['version']}, expected {BENCH_VERSION}")
+            return 2
+        # measure exactly what the baseline measured
+        settings = baseline["settings"]
+        args.phases = list(baseline["phases"])
+
+    result = run(settings, args.repeat, args.phases)
+    print_result(result)
+    if args.save:
+        save(result, args.save)
+    if baseline is not None:
+        for phase, metric, old, new in compare(baseline, result, args.threshold):
+            print(f"REGRESSION {phase} {metric}: {old:.6g} -> {new:.6g} ({new / old - 1:+.0%})")
+            status = 1
+    return status
+
+sys.exit(main())
@@ -0,0 +1,168 @@
+import gc
+import json
+import platform
+import time
+import tracemalloc
+
+from ..Lexer import Lexer
+from ..Parser import Parser
+from ..constant_fold import constant_fold
+from ..simplify import simplify
+from ..dce import eliminate
+from ..nodegen import NodeGen
+from ..apply import BpyApplier
+from ..fake_bpy import FakeBpy
+from .synth import Synth
+
+# bump whenever what is measured changes, baselines of another version
+# aren't compared against
+BENCH_VERSION = 3
+
+def scanned(source):
+    lexer = Lexer(source)
+    return list(lexer.scan()), lexer.line_map
+
+def parsed(source):
+    return list(Parser(*scanned(source)).parse())
+
+def folded(source):
+    return list(constant_fold(parsed(source)))
+
+def simplified(source):
+    return list(simplify(folded(source)))
+
+def eliminated(source):
+    return list(eliminate(simplified(source)))
+
+def generated(source):
+    return NodeGen(eliminated(source), "Bench", "ShaderNodeTree").start()
+
+def apply_graphs(graphs):
+    bpy = FakeBpy()
+    tree = bpy.new_tree("Bench", "ShaderNodeTree")
+    applier = BpyApplier(bpy)
+    for graph in graphs:
+        applier.apply(graph, None if graph.is_group else tree)
+    return bpy
+
+# phase => (function timed, function preparing its input from the source)
+#
+# every phase runs on its own, its input is built before the clock
+# starts. Folding and simplifying rewrite the AST in place, so each
+# repetition gets a fresh input
+PHASES = {
+    "lex": (lambda source: list(Lexer(source).lexfile()), lambda source: source),
+    "parse": (lambda tokens: list(Parser(*tokens).parse()), scanned),
+    "fold": (lambda ast: list(constant_fold(ast)), parsed),
+    "simplify": (lambda ast: list(simplify(ast)), folded),
+    "dce": (lambda ast: list(eliminate(ast)), simplified),
+    "nodegen": (lambda ast: NodeGen(ast, "Bench", "ShaderNodeTree").start(), eliminated),
+    "apply": (apply_graphs, generated),
+}
+
+def measure(fn, make_input, source, repeat, trace_memory=True):
+    """
+    Fastest of `repeat` runs and the peak memory of one more traced run,
+    tracing slows everything down so it's never timed
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        value = make_input(source)
+        gc.collect()
+        start = time.perf_counter()
+        result = fn(value)
+        best = min(best, time.perf_counter() - start)
+        if trace_memory:
+            del result
+    if not trace_memory:
+        return best, None, result
+
+    value = make_input(source)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn(value)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+def run(settings, repeat=3, phases=None, trace_memory=True):
+    """
+    Benchmarks every phase on the source `settings` generate, returns a
+    JSON serializable result
+    """
+    source = Synth(**settings).source()
+    results = {}
+    counts = {"bytes": len(source)}
+    for phase in phases or PHASES:
+        fn, make_input = PHASES[phase]
+        seconds, peak, result = measure(fn, make_input, source, repeat, trace_memory)
+        results[phase] = {"seconds": seconds, "peak_bytes": peak}
+        if phase == "lex":
+            counts["tokens"] = len(result)
+            results[phase]["tokens_per_sec"] = len(result) / seconds if seconds else 0
+        elif phase == "nodegen":
+            counts["graphs"] = len(result)
+            counts["nodes"] = sum(len(graph.nodes) for graph in result)
+            counts["links"] = sum(len(graph.links) for graph in result)
+        elif phase == "apply":
+            counts["rna_calls"] = result.calls
+    return {
+        "version": BENCH_VERSION,
+        "python": platform.python_version(),
+        "settings": settings,
+        "repeat": repeat,
+        "counts": counts,
+        "phases": results,
+    }
+
+def save(result, path):
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare(baseline, result, threshold=0.2):
+    """
+    Yields `(phase, metric, old, new)` for every phase that got slower or
+    used more memory than `threshold` allows, 0.2 being 20%
+    """
+    for phase, old in baseline["phases"].items():
+        new = result["phases"].get(phase)
+        if new is None:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if old[metric] is None or new[metric] is None:
+                continue
+            if new[metric] > old[metric] * (1 + threshold):
+                yield phase, metric, old[metric], new[metric]
+
+def scaling(settings, factors=(1, 10, 100), repeat=1, phases=None):
+    """
+    Times each phase with `settings["functions"]` multiplied by each of
+    `factors`, returns factor => (phase => seconds per token)
+    """
+    per_token = {}
+    for factor in factors:
+        scaled = dict(settings, functions=settings.get("functions", 10) * factor)
+        result = run(scaled, repeat, phases, trace_memory=False)
+        tokens = len(scanned(Synth(**scaled).source())[0])
+        per_token[factor] = {
+            phase: r["seconds"] / tokens for phase, r in result["phases"].items()}
+    return per_token
+
+def nonlinear(per_token, tolerance=0.5):
+    """
+    Yields `(phase, factor, ratio)` for the phases whose time per token at
+    `factor` grew past `1 + tolerance` times the smallest input's
+    """
+    factors = sorted(per_token)
+    base = per_token[factors[0]]
+    for factor in factors[1:]:
+        for phase, seconds in per_token[factor].items():
+            ratio = seconds / base[phase] if base[phase] else 0
+            if ratio > 1 + tolerance:
+                yield phase, factor, ratio
@@ -0,0 +1,74 @@
+import random
+
+OPS = ["+", "-", "*", "/"]
+
+class Synth:
+    """
+    Writes synthetic GLSL that the compiler accepts, the same seed and
+    settings always give the same source
+
+        functions   number of functions
+        depth       how deeply expressions nest parentheses
+        width       operands per parenthesized level
+        decls       local declarations per function
+        globals     top level declarations
+        literals    chance that an operand is a literal
+    """
+    def __init__(self, seed=0, functions=10, depth=2, width=4, decls=8, globals=4, literals=0.3):
+        self.rng = random.Random(seed)
+        self.functions = functions
+        self.depth = depth
+        self.width = width
+        self.decls = decls
+        self.globals = globals
+        self.literals = literals
+
+    def literal(self):
+        # never 0, folding a division by it would fail
+        return f"{self.rng.uniform(0.1, 9.9):.2f}"
+
+    def operand(self, names, depth):
+        rng = self.rng
+        if depth > 0 and rng.random() < 0.5:
+            operand = f"({self.expr(names, depth - 1)})"
+        elif names and rng.random() >= self.literals:
+            operand = rng.choice(names)
+        else:
+            operand = self.literal()
+        return f"-{operand}" if rng.random() < 0.1 else operand
+
+    def expr(self, names, depth):
+        parts = [self.operand(names, depth)]
+        for _ in range(self.width - 1):
+            parts.append(self.rng.choice(OPS))
+            parts.append(self.operand(names, depth))
+        return " ".join(parts)
+
+    def function(self, i):
+        args = ["a", "b", "c"]
+        lines = [f"void f{i}(in float a, in float b, in float c, out float r) {{"]
+        names = args + self.constants()
+        decls = []
+        for j in range(self.decls):
+            lines.append(f"    float v{j} = {self.expr(names + decls, self.depth)};")
+            decls.append(f"v{j}")
+        lines.append(f"    r = {self.expr(decls or args, self.depth)};")
+        lines.append("}")
+        return "\n".join(lines)
+
+    def constants(self):
+        # a function can only read a global that folds to a constant
+        return [f"g{i}" for i in range(0, self.globals, 2)]
+
+    def source(self):
+        items = []
+        for i in range(self.globals):
+            # the odd globals refer to the ones before them, the even
+            # ones are constants
+            names = [f"g{j}" for j in range(i)] if i % 2 else []
+            items.append(f"float g{i} = {self.expr(names, self.depth)};")
+        items.extend(self.function(i) for i in range(self.functions))
+        return "\n".join(items) + "\n"
+
+def generate_source(seed=0, **settings):
+    return Synth(seed, **settings).source()
@@ -0,0 +1,136 @@
+import gc
+import os
+import pickle
+import tempfile
+from contextlib import contextmanager
+from copy import copy
+from hashlib import blake2b
+
+from .visitor import CHILDREN, set_children
+
+# part of every key, bump it whenever the folded IR or codegen changes
+# so entries written by an older compiler are never loaded. That includes
+# any change to the nodes a source compiles to, not only to what's
+# stored, since a fingerprint only hashes the source
+COMPILER_VERSION = 7
+
+@contextmanager
+def paused_gc():
+    """
+    For code that allocates lots of objects and no garbage, otherwise
+    the cyclic collector keeps rescanning them and it takes several
+    times longer. Only around code that doesn't yield, the collector is
+    off for the whole process and a generator would leave it off for
+    whoever consumes it
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def flatten(root):
+    """
+    The nodes below `root` in post-order as (shallow copy, number of
+    children) pairs, pickling a deep expression directly would hit the
+    recursion limit
+    """
+    items = []
+    stack = [(root, False)]
+    while stack:
+        node, done = stack.pop()
+        children = CHILDREN[type(node)](node)
+        if done:
+            node = copy(node)
+            set_children(node, [None] * len(children))
+            items.append((node, len(children)))
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+    return items
+
+def unflatten(items):
+    stack = []
+    for node, n in items:
+        children = stack[len(stack) - n:]
+        del stack[len(stack) - n:]
+        set_children(node, children)
+        stack.append(node)
+    return stack[0]
+
+class DiskCache:
+    """
+    Pickled compile results in a directory, shared between sessions
+
+    entries are keyed by a hash of the source they were compiled from,
+    the codegen `options` that change what it compiles to, like the tree
+    type, and `COMPILER_VERSION`. Files are written to a temporary name and
+    renamed into place, so other Blender instances using the same
+    directory never read half an entry. Reading an entry bumps its
+    mtime and `evict()` removes the least recently used entries once
+    the directory grows past `max_size` bytes
+    """
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source_hash, options=()):
+        parts = [str(COMPILER_VERSION), *map(str, options), source_hash]
+        return blake2b("\0".join(parts).encode(), digest_size=16).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, source_hash, options=()):
+        path = self.path(self.key(source_hash, options))
+        try:
+            with open(path, "rb") as f, paused_gc():
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # missing, evicted by another instance or unreadable
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, source_hash, value, options=()):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError as e:
+            print(f"Could not write to the compile cache: {e}")
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path(self.key(source_hash, options)))
+        except (OSError, pickle.PicklingError) as e:
+            print(f"Could not write to the compile cache: {e}")
+            os.remove(tmp)
+
+    def evict(self):
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith(".pickle")]
+        except OSError:
+            return
+        stats = []
+        for entry in entries:
+            try:
+                stats.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except OSError:
+                pass
+        size = sum(s for _, s, _ in stats)
+        for _, entry_size, path in sorted(stats):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # another instance got to it first
+                pass
+            size -= entry_size
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from .compiler import generate
+from .artifact import ArtifactWriter
+
+SUFFIXES = {"binary": ".glng", "json": ".json"}
+
+def find_sources(paths, suffix=".glng"):
+    """
+    Yields `(source, artifact name)` for the `.glsl` files in `paths`,
+    directories are searched recursively and keep their layout. A file
+    given on its own keeps its relative directory, unless the path is
+    absolute or goes up out of the working directory
+    """
+    for path in map(Path, paths):
+        if path.is_dir():
+            for source in sorted(path.rglob("*.glsl")):
+                yield source, source.relative_to(path).with_suffix(suffix)
+        elif path.is_absolute() or ".." in path.parts:
+            yield path, Path(path.name).with_suffix(suffix)
+        else:
+            yield path, path.with_suffix(suffix)
+
+def compile_file(source, artifact, tree_type="ShaderNodeTree", legacy_lexer=False, format="binary", specialize=0):
+    """
+    Compiles one file and writes its graphs to `artifact`, runs in a
+    worker process. Returns a timing summary
+    """
+    start = time.perf_counter()
+    write = 0
+    try:
+        with open(source, "r") as f:
+            content = f.read()
+        artifact.parent.mkdir(parents=True, exist_ok=True)
+        # written next to the artifact and renamed over it once complete,
+        # a failed compile leaves the last good artifact in place
+        fd, tmp = tempfile.mkstemp(dir=artifact.parent, suffix=".tmp")
+        try:
+            with open(fd, "wb") as f:
+                graphs = []
+                if format == "binary":
+                    # each graph is written as soon as it's generated
+                    with ArtifactWriter(f) as writer:
+                        for graph in generate(content, source.stem, tree_type, legacy_lexer=legacy_lexer, specialize=specialize):
+                            w = time.perf_counter()
+                            writer.write(graph)
+                            write += time.perf_counter() - w
+                            graphs.append(graph)
+                else:
+                    graphs = list(generate(content, source.stem, tree_type, legacy_lexer=legacy_lexer, specialize=specialize))
+                    w = time.perf_counter()
+                    f.write(json.dumps([graph.to_dict() for graph in graphs], separators=(",", ":")).encode())
+                    write = time.perf_counter() - w
+            os.replace(tmp, artifact)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    except Exception as e:
+        return {"source": str(source), "error": f"{type(e).__name__}: {e}"}
+    end = time.perf_counter()
+    return {
+        "source": str(source),
+        "artifact": str(artifact),
+        "bytes": len(content),
+        "groups": sum(1 for graph in graphs if graph.is_group),
+        "nodes": sum(len(graph.nodes) for graph in graphs),
+        "compile": end - start - write,
+        "write": write,
+    }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m glsl_compiler",
+        description="Compiles GLSL sources to node graph artifacts outside of Blender")
+    parser.add_argument("paths", nargs="+", help="`.glsl` files or directories of them")
+    parser.add_argument("-o", "--output", default="build", help="where the artifacts go (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes (default: one per core)")
+    parser.add_argument("--tree-type", default="ShaderNodeTree", choices=["ShaderNodeTree", "GeometryNodeTree"])
+    parser.add_argument("--legacy-lexer", action="store_true")
+    parser.add_argument("--format", default="binary", choices=list(SUFFIXES),
+                        help="binary artifacts load without compiling, json is for reading (default: %(default)s)")
+    parser.add_argument("--specialize", type=int, default=0, metavar="N",
+                        help="specialize up to N node groups per file for constant arguments (default: off)")
+    return parser.parse_args(argv)
+
+def print_summary(results, wall):
+    width = max((len(r["source"]) for r in results), default=0)
+    for r in sorted(results, key=lambda r: r.get("compile", 0), reverse=True):
+        if "error" in r:
+            print(f"{r['source']:<{width}}  FAILED {r['error']}")
+        else:
+            print(f"{r['source']:<{width}}  {r['compile'] * 1000:9.1f}ms compile {r['write'] * 1000:7.1f}ms write"
+                  f"  {r['groups']:5} groups {r['nodes']:7} nodes")
+    done = [r for r in results if "error" not in r]
+    size = sum(r["bytes"] for r in done)
+    print(f"{len(done)}/{len(results)} files, {size / 1024:.0f} KiB in {wall:.2f}s"
+          f" ({len(done) / wall if wall else 0:.1f} files/s)")
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = Path(args.output)
+    jobs = []
+    # artifact => the source written to it
+    sources = {}
+    for source, artifact in find_sources(args.paths, SUFFIXES[args.format]):
+        other = sources.setdefault(artifact, source)
+        if other != source:
+            print(f"{source} and {other} would both be written to {output / artifact}")
+            return 1
+        jobs.append((source, output / artifact, args.tree_type, args.legacy_lexer, args.format, args.specialize))
+
+    start = time.perf_counter()
+    if args.jobs <= 1:
+        results = [compile_file(*job) for job in jobs]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(compile_file, *job) for job in jobs]
+            for future in as_completed(futures):
+                results.append(future.result())
+    wall = time.perf_counter() - start
+
+    print_summary(results, wall)
+    output.mkdir(parents=True, exist_ok=True)
+    with open(output / "timings.json", "w") as f:
+        json.dump({"wall": wall, "files": results}, f, indent=2)
+    return 1 if any("error" in r for r in results) else 0
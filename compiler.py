@@ -0,0 +1,83 @@
+from .Lexer import Lexer
+from .Parser import Parser
+from .constant_fold import constant_fold
+from .simplify import simplify
+from .dce import reachable, eliminate
+from .nodegen import NodeGen
+from .apply import BpyApplier
+from .profiling import count_nodes
+
+def front_end(content, legacy_lexer=False, saved=None, dump_tokens=None, dump_ast=None, profiler=None, entry=None, dead=None):
+    """
+    Lexes, parses, folds and simplifies `content`
+
+    every stage is a generator, a top level item goes through all of
+    them as soon as the parser finishes it. `dump_tokens` and
+    `dump_ast` may wrap the token and AST streams for debug output,
+    a `profiling.Profiler` times each stage. With an `entry` function
+    only the functions it needs are compiled, `dead` is a
+    `dce.DeadCode` reporting what was removed
+    """
+    lexer = Lexer(content, legacy=legacy_lexer)
+    tokens = lexer.scan()
+    if profiler:
+        tokens = profiler.stage("lex", tokens, unit="tokens")
+    if dump_tokens:
+        tokens = dump_tokens(tokens, lexer.line_map)
+    if entry:
+        tokens = reachable(tokens, entry, dead)
+        if profiler:
+            tokens = profiler.stage("reachability", tokens, unit="tokens")
+    return fold(tokens, lexer.line_map, saved, dump_ast, profiler, dead)
+
+def fold(tokens, line_map, saved=None, dump_ast=None, profiler=None, dead=None, signatures=None):
+    """
+    Parses, folds, simplifies and removes dead stores from a stream of
+    raw tokens, see `dce.eliminate()` for `signatures`
+    """
+    ast = Parser(tokens, line_map).parse()
+    if profiler:
+        ast = profiler.stage("parse", ast, count_nodes, "AST nodes")
+    if dump_ast:
+        ast = dump_ast(ast)
+    ast = constant_fold(ast)
+    if profiler:
+        ast = profiler.stage("fold", ast)
+    ast = simplify(ast, saved)
+    if profiler:
+        ast = profiler.stage("simplify", ast, count_nodes, "nodes after folding")
+    ast = eliminate(ast, dead, signatures)
+    if profiler:
+        ast = profiler.stage("dce", ast)
+    return ast
+
+def generate(content, tree_name, tree_type, profiler=None, specialize=0, **kwargs):
+    """
+    Yields the `graph.Graph`s for `content`, see `NodeGen.generate()`.
+    Up to `specialize` groups are specialized for constant args
+    """
+    ast = front_end(content, profiler=profiler, **kwargs)
+    return NodeGen(ast, tree_name, tree_type, profiler, specialize).generate()
+
+def compile_headless(content, tree_name="NodeTree", tree_type="ShaderNodeTree", bpy=None, tree=None, incremental=None, **kwargs):
+    """
+    Runs the whole pipeline against `fake_bpy`, pass the `bpy` and `tree`
+    of an earlier run to recompile into them, and the
+    `incremental.IncrementalCompiler` it used to only rebuild the
+    functions that changed. Returns the fake bpy
+    module, the tree the top level items were applied to and what the
+    applier changed
+    """
+    if bpy is None:
+        from .fake_bpy import FakeBpy
+        bpy = FakeBpy()
+    if tree is None:
+        tree = bpy.new_tree(tree_name, tree_type)
+    applier = BpyApplier(bpy)
+    if incremental is not None:
+        graphs = incremental.generate(content, tree.name, tree_type, **kwargs)
+    else:
+        graphs = generate(content, tree.name, tree_type, **kwargs)
+    for graph in graphs:
+        applier.apply(graph, None if graph.is_group else tree)
+    return bpy, tree, applier.changes
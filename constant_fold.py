@@ -1,52 +1,252 @@
-from .TokenTypes import LiteralKind
+import math
+
+from .TokenTypes import LiteralKind, TypeKind
 from .ast import *
 from .Lexer import Literal, TokenKind
+from .visitor import Visitor, walk
+from .intrinsics import lookup, NAMES
+from .type_infer import CONSTRUCTORS
 
 def constant_fold(ast):
-    return walk(ast)
+    """
+    Folds each top level item as it's pulled from `ast`
+    """
+    folder = ConstantFold()
+    for node in ast:
+        yield folder.visit(node)
 
-def walk(nodes):
-    def binary(node: Binary):
-        left = node.left
-        right = node.right
-        if isinstance(left, Binary):
-            left = binary(left)
+def literal_value(lit: Literal):
+    """
+    The python value of a literal, lexed literals still hold their source text
+    """
+    if lit.typ == LiteralKind.BOOL:
+        return lit.value in {True, "true"}
+    elif lit.typ == LiteralKind.INT:
+        return int(lit.value)
+    return float(lit.value)
 
-        if isinstance(right, Binary):
-            right = binary(right)
+def make_literal(kind, value):
+    if kind == LiteralKind.BOOL:
+        return Literal(kind, bool(value))
+    elif kind == LiteralKind.INT:
+        return Literal(kind, int(value))
+    return Literal(kind, float(value))
 
-        if type(left) == Literal and type(right) == Literal:
-            if node.op.typ == TokenKind.PLUS:
-                return Literal(LiteralKind.FLOAT, float(left.value) + float(right.value))
-            elif node.op.typ == TokenKind.MINUS:
-                return Literal(LiteralKind.FLOAT, float(left.value) - float(right.value))
-            elif node.op.typ == TokenKind.STAR:
-                return Literal(LiteralKind.FLOAT, float(left.value) * float(right.value))
-            elif node.op.typ == TokenKind.SLASH:
-                return Literal(LiteralKind.FLOAT, float(left.value) / float(right.value))
-            else:
-                assert False
+def is_user_call(node):
+    return type(node) == Call and node.name not in NAMES and node.name not in CONSTRUCTORS
+
+def int_div(a, b):
+    # glsl integer division truncates towards zero
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+NUMERIC = {LiteralKind.INT, LiteralKind.FLOAT}
+
+# TokenKind => (int fold, float fold), `None` when the op is undefined
+# for floats
+ARITH_OPS = {
+    TokenKind.PLUS:    (lambda a, b: a + b, lambda a, b: a + b),
+    TokenKind.MINUS:   (lambda a, b: a - b, lambda a, b: a - b),
+    TokenKind.STAR:    (lambda a, b: a * b, lambda a, b: a * b),
+    TokenKind.SLASH:   (int_div,            lambda a, b: a / b),
+    TokenKind.PERCENT: (lambda a, b: int(math.fmod(a, b)), math.fmod),
+    TokenKind.LT2:     (lambda a, b: a << b, None),
+    TokenKind.GT2:     (lambda a, b: a >> b, None),
+    TokenKind.AMPERSAND: (lambda a, b: a & b, None),
+    TokenKind.PIPE:    (lambda a, b: a | b, None),
+}
+
+COMPARE_OPS = {
+    TokenKind.LT:     lambda a, b: a < b,
+    TokenKind.GT:     lambda a, b: a > b,
+    TokenKind.EQ2:    lambda a, b: a == b,
+    TokenKind.BANGEQ: lambda a, b: a != b,
+}
+
+LOGIC_OPS = {
+    TokenKind.AMPERSAND2: lambda a, b: a and b,
+    TokenKind.PIPE2:      lambda a, b: a or b,
+}
+
+# Blender Math operation => how to evaluate it
+MATH_OPS = {
+    "ADD":          lambda a, b: a + b,
+    "SUBTRACT":     lambda a, b: a - b,
+    "MULTIPLY":     lambda a, b: a * b,
+    "DIVIDE":       lambda a, b: a / b,
+    "MULTIPLY_ADD": lambda a, b, c: a * b + c,
+    "POWER":        math.pow,
+}
+
+# declared type => literal kind a constant is converted to when stored
+TYPE_LITERAL_KINDS = {
+    TypeKind.INT:   LiteralKind.INT,
+    TypeKind.FLOAT: LiteralKind.FLOAT,
+    TypeKind.BOOL:  LiteralKind.BOOL,
+}
+
+def fold_binary(op, left: Literal, right: Literal):
+    """
+    Returns the folded `Literal` or None if `op` can't be evaluated
+    for these operands at compile time
+    """
+    a, b = literal_value(left), literal_value(right)
+    if op in ARITH_OPS:
+        if left.typ not in NUMERIC or right.typ not in NUMERIC:
+            return None
+        if left.typ == right.typ == LiteralKind.INT:
+            kind, fold = LiteralKind.INT, ARITH_OPS[op][0]
         else:
-            node.left = left
-            node.right = right
-            return node
-
-    def assign(node):
-        ty = type(node.init)
-        if ty == Binary:
-            node.init = binary(node.init)
-        return node
-
-    for i in range(len(nodes)):
-        node = nodes[i]
-        ty = type(node)
-        if ty == FnDef:
-            node.body = walk(node.body)
-        elif ty == Binary:
-            nodes[i] = binary(node)
-        elif ty == Assign:
-            nodes[i] = assign(node)
-        elif ty == Decl:
-            nodes[i].expr = assign(node.expr)
-
-    return nodes
+            # ints are implicitly converted when mixed with floats
+            kind, fold = LiteralKind.FLOAT, ARITH_OPS[op][1]
+        if fold is None or (op in {TokenKind.SLASH, TokenKind.PERCENT} and b == 0):
+            return None
+        if op in {TokenKind.LT2, TokenKind.GT2} and not 0 <= b < 32:
+            # undefined for 32 bit ints, and python would build a huge
+            # one or raise
+            return None
+        return make_literal(kind, fold(a, b))
+    elif op in COMPARE_OPS:
+        if (left.typ == LiteralKind.BOOL) != (right.typ == LiteralKind.BOOL):
+            return None
+        return make_literal(LiteralKind.BOOL, COMPARE_OPS[op](a, b))
+    elif op in LOGIC_OPS:
+        if left.typ != LiteralKind.BOOL or right.typ != LiteralKind.BOOL:
+            return None
+        return make_literal(LiteralKind.BOOL, LOGIC_OPS[op](a, b))
+    return None
+
+def fold_unary(op, right: Literal):
+    if op == TokenKind.MINUS and right.typ in NUMERIC:
+        return make_literal(right.typ, -literal_value(right))
+    elif op == TokenKind.BANG and right.typ == LiteralKind.BOOL:
+        return make_literal(LiteralKind.BOOL, not literal_value(right))
+    return None
+
+class ConstantFold(Visitor):
+    """
+    Constant propagation and folding
+
+    function bodies are straight line code, so walking the statements
+    in order and remembering the last constant stored into every local
+    is enough to substitute it into the uses that follow. Locals that
+    only ever hold constants disappear entirely, out params and globals
+    are always kept
+    """
+    def __init__(self):
+        # name => Literal for locals currently holding a known constant
+        self.env = {}
+        # name => TypeKind of every local of the current function
+        self.locals = {}
+        # locals passed to a function, any of them might be an out arg
+        # so they never hold a known constant
+        self.pinned = set()
+        # locals assigned after their declaration
+        self.assigned = set()
+        self.in_function = False
+
+    def enter_FnDef(self, node):
+        self.env = {}
+        self.locals = {}
+        self.pinned = {arg.name for call in walk(node) if is_user_call(call)
+                       for arg in call.args if type(arg) == Ident}
+        nodes = list(walk(node))
+        inits = {id(decl.expr) for decl in nodes if type(decl) == Decl}
+        self.assigned = {assign.name for assign in nodes if type(assign) == Assign and id(assign) not in inits}
+        self.in_function = True
+
+    def visit_FnDef(self, node, *body):
+        # statements that folded away are either `None` or a bare literal
+        node.body = [stmt for stmt in body if stmt is not None and type(stmt) != Literal]
+        self.in_function = False
+        self.env = {}
+        self.locals = {}
+        self.pinned = set()
+        self.assigned = set()
+        return node
+
+    def enter_Decl(self, node):
+        name = node.expr.name if isinstance(node.expr, (Assign, Ident)) else None
+        if self.in_function and name is not None:
+            self.locals[name] = node.typ
+            self.env.pop(name, None)
+
+    def visit_Decl(self, node, expr):
+        if type(expr) == Literal and self.in_function:
+            # the value already lives in `env` and every use will be
+            # replaced by it, the name stays declared if it's assigned
+            # something else later
+            name = node.expr.name
+            return Decl(node.typ, Ident(name)) if name in self.assigned else None
+        if type(expr) == Assign and type(expr.init) == Literal:
+            expr.init = self.convert(node.typ, expr.init)
+        node.expr = expr
+        return node
+
+    def convert(self, typ, value: Literal):
+        kind = TYPE_LITERAL_KINDS.get(typ)
+        if kind is None or kind == value.typ:
+            return value
+        if kind == LiteralKind.BOOL or value.typ == LiteralKind.BOOL:
+            return value
+        return make_literal(kind, literal_value(value))
+
+    def visit_Assign(self, node, init):
+        local = self.in_function and node.name in self.locals and node.name not in self.pinned
+        if type(init) == Literal:
+            init = self.convert(self.locals.get(node.name), init)
+            if local:
+                self.env[node.name] = init
+                return init
+        else:
+            self.env.pop(node.name, None)
+        node.init = init
+        return node
+
+    def visit_Binary(self, node, left, right):
+        if type(left) == Literal and type(right) == Literal:
+            folded = fold_binary(node.op.typ, left, right)
+            if folded is not None:
+                return folded
+
+        node.left = left
+        node.right = right
+        return node
+
+    def visit_Unary(self, node, right):
+        if type(right) == Literal:
+            folded = fold_unary(node.op.typ, right)
+            if folded is not None:
+                return folded
+
+        node.right = right
+        return node
+
+    def visit_Call(self, node, *args):
+        if all(type(arg) == Literal and arg.typ in NUMERIC for arg in args):
+            # only scalar overloads can have all literal args
+            intrinsic = lookup(node.name, [TypeKind.FLOAT] * len(args))
+            if intrinsic is not None:
+                try:
+                    value = intrinsic.fold(*map(literal_value, args))
+                    return make_literal(LiteralKind.FLOAT, value)
+                except (ValueError, ZeroDivisionError, OverflowError):
+                    pass
+        node.args = list(args)
+        return node
+
+    def visit_MathOp(self, node, *args):
+        if node.operation in MATH_OPS and all(type(arg) == Literal for arg in args):
+            try:
+                value = MATH_OPS[node.operation](*map(literal_value, args))
+                return make_literal(LiteralKind.FLOAT, value)
+            except (ValueError, ZeroDivisionError, OverflowError):
+                pass
+        node.args = list(args)
+        return node
+
+    def visit_Ident(self, node):
+        return self.env.get(node.name, node)
+
+    def visit_Literal(self, node):
+        return node
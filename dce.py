@@ -0,0 +1,191 @@
+from .ast import *
+from .Lexer import TokenKind
+from .visitor import walk
+from .simplify import count_ops
+from .constant_fold import is_user_call
+
+IN_ARGS = {None, TokenKind.IN, TokenKind.INOUT}
+OUT_ARGS = {TokenKind.OUT, TokenKind.INOUT}
+
+class DeadCode:
+    """
+    What dead code elimination removed, for the report
+    """
+    def __init__(self):
+        # functions neither the entry nor the top level can reach
+        self.functions = []
+        # function name => [statements, nodes] removed from its body
+        self.removed = {}
+
+    def count(self, name, stmt, dropped=True):
+        removed = self.removed.setdefault(name, [0, 0])
+        removed[0] += dropped
+        removed[1] += count_ops(stmt)
+
+def split_items(tokens):
+    """
+    Groups raw tokens into top level items, a function ends with the `}`
+    closing its body and anything else with a `;`
+    """
+    item = []
+    depth = 0
+    for tok in tokens:
+        item.append(tok)
+        kind = tok[0]
+        if kind == TokenKind.LCURLY:
+            depth += 1
+        elif kind == TokenKind.RCURLY:
+            depth -= 1
+            if depth == 0:
+                yield item
+                item = []
+        elif kind == TokenKind.SEMI and depth == 0:
+            yield item
+            item = []
+    if item:
+        yield item
+
+def function_name(item):
+    """
+    The name of the function `item` defines, `None` for anything else
+    """
+    if len(item) > 2 and item[0][0] == TokenKind.TYPE and \
+            item[1][0] == TokenKind.IDENT and item[2][0] == TokenKind.LPAREN:
+        return item[1][1]
+    return None
+
+def reachable(tokens, entry, dead=None):
+    """
+    Drops the functions that `entry` and the top level items don't call,
+    directly or through other functions, before they're even parsed
+
+    a function's calls are the names it mentions, a variable named like
+    a function only keeps something alive for nothing. Which function is
+    unreachable is only known at the end, so the whole token stream is
+    read first
+    """
+    items = list(split_items(tokens))
+    # function name => names it mentions
+    functions = {}
+    roots = {entry}
+    for item in items:
+        idents = {value for kind, value, _, _ in item if kind == TokenKind.IDENT}
+        name = function_name(item)
+        if name is None:
+            roots |= idents
+        else:
+            functions.setdefault(name, set()).update(idents)
+    assert entry in functions, f"No function `{entry}` to start from"
+
+    live = set()
+    stack = [name for name in roots if name in functions]
+    while stack:
+        name = stack.pop()
+        if name not in live:
+            live.add(name)
+            stack.extend(callee for callee in functions[name] if callee in functions)
+    for item in items:
+        name = function_name(item)
+        if name is None or name in live:
+            yield from item
+        elif dead is not None and name not in dead.functions:
+            dead.functions.append(name)
+
+def eliminate(ast, dead=None, signatures=None):
+    """
+    Removes the statements of each function that don't contribute to
+    its outputs as it's pulled from `ast`, see `DeadStores`
+
+    `signatures` holds the `FnSig`s of functions that aren't in `ast`,
+    they tell which args of a call are written
+    """
+    stores = DeadStores(dead, signatures)
+    for node in ast:
+        if isinstance(node, FnDef):
+            stores.function(node)
+        yield node
+
+class DeadStores:
+    """
+    Backwards liveness over a function body
+
+    bodies are straight line code, so walking the statements from the
+    last one up while tracking the names something below still reads is
+    enough. A store to a name nothing reads before it's stored again is
+    dropped with everything it computes, out args are read by the group
+    output. A declaration whose value is dead but whose name is stored
+    to later keeps declaring its type
+    """
+    def __init__(self, dead=None, signatures=None):
+        self.dead = dead
+        # function name => FnSig
+        self.signatures = {} if signatures is None else signatures
+
+    def function(self, fn: FnDef):
+        sign = fn.signature
+        self.signatures[sign.name] = sign
+        live = {arg.name for arg in sign.args if arg.props in OUT_ARGS}
+        # names used anywhere below the current statement
+        later = set(live)
+        body = []
+        for stmt in reversed(fn.body):
+            writes, reads, pure = self.effects(stmt)
+            if pure and not writes & live:
+                declares = type(stmt) == Decl and writes & later
+                if self.dead is not None:
+                    self.dead.count(sign.name, stmt, not declares)
+                if not declares:
+                    continue
+                stmt = Decl(stmt.typ, Ident(next(iter(writes))))
+                reads = set()
+            live -= writes
+            live |= reads
+            later |= writes | reads
+            body.append(stmt)
+        body.reverse()
+        fn.body = body
+
+    def effects(self, stmt):
+        """
+        The names `stmt` stores to and reads, and whether it does
+        nothing else so it can be dropped when nothing reads its stores
+        """
+        ty = type(stmt)
+        if ty == Decl and type(stmt.expr) == Ident:
+            return {stmt.expr.name}, set(), True
+        if is_user_call(stmt):
+            return self.call_effects(stmt)
+        if ty == Decl:
+            stmt = stmt.expr
+            ty = Assign
+        writes = set()
+        if ty == Assign:
+            writes.add(stmt.name)
+            stmt = stmt.init
+        reads = set()
+        # `a = b = c` stores to `b` as well
+        pure = True
+        for node in walk(stmt):
+            if type(node) == Ident:
+                reads.add(node.name)
+            elif type(node) == Assign:
+                writes.add(node.name)
+                pure = False
+        return writes, reads, pure
+
+    def call_effects(self, call: Call):
+        sign = self.signatures.get(call.name)
+        reads = set()
+        if sign is None:
+            # any variable passed might be an out arg, and then it's
+            # neither dead nor can it be dropped
+            for arg in call.args:
+                reads.update(node.name for node in walk(arg) if type(node) == Ident)
+            return set(), reads, False
+        writes = set()
+        for arg, value in zip(sign.args, call.args):
+            if arg.props in OUT_ARGS and type(value) == Ident:
+                writes.add(value.name)
+            if arg.props in IN_ARGS:
+                reads.update(node.name for node in walk(value) if type(node) == Ident)
+        return writes, reads, True
@@ -0,0 +1,227 @@
+"""
+A stand-in for the parts of `bpy` the applier uses
+
+lets the whole compiler run, and be timed, outside of Blender, every
+call into the fake "RNA" is counted in `FakeBpy.calls`
+"""
+
+class FakeSocket:
+    def __init__(self, node, name):
+        self.node = node
+        self.name = name
+        self.default_value = 0.0
+
+class FakeSockets:
+    """
+    Sockets are created on first access, by index or by name
+    """
+    def __init__(self, bpy, node):
+        self._bpy = bpy
+        self._node = node
+        self._sockets = []
+
+    def __getitem__(self, key):
+        self._bpy.calls += 1
+        if isinstance(key, int):
+            while len(self._sockets) <= key:
+                self._sockets.append(FakeSocket(self._node, str(len(self._sockets))))
+            return self._sockets[key]
+        for socket in self._sockets:
+            if socket.name == key:
+                return socket
+        socket = FakeSocket(self._node, key)
+        self._sockets.append(socket)
+        return socket
+
+    def __iter__(self):
+        return iter(self._sockets)
+
+    def __len__(self):
+        return len(self._sockets)
+
+class FakeNode:
+    def __init__(self, tree, bl_idname):
+        self._tree = tree
+        self._name = bl_idname
+        self.bl_idname = bl_idname
+        self.label = ""
+        self.location = (0, 0)
+        self.inputs = FakeSockets(tree._bpy, self)
+        self.outputs = FakeSockets(tree._bpy, self)
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._tree._bpy.calls += 1
+        self._tree.nodes._rename(self, name)
+
+    def as_pointer(self):
+        return id(self)
+
+class FakeNodes:
+    def __init__(self, tree):
+        self._tree = tree
+        self._nodes = {}
+        self._suffixes = {}
+
+    def _unique_name(self, name):
+        if name not in self._nodes:
+            return name
+        i = self._suffixes.get(name, 1)
+        while f"{name}.{i:03}" in self._nodes:
+            i += 1
+        self._suffixes[name] = i + 1
+        return f"{name}.{i:03}"
+
+    def _rename(self, node, name):
+        if self._nodes.get(node._name) is node:
+            del self._nodes[node._name]
+        node._name = self._unique_name(name)
+        self._nodes[node._name] = node
+
+    def new(self, type):
+        self._tree._bpy.calls += 1
+        node = FakeNode(self._tree, type)
+        self._rename(node, type)
+        return node
+
+    def get(self, name, default=None):
+        self._tree._bpy.calls += 1
+        return self._nodes.get(name, default)
+
+    def remove(self, node):
+        self._tree._bpy.calls += 1
+        self._tree.links._unlink_node(node)
+        del self._nodes[node._name]
+
+    def clear(self):
+        self._tree._bpy.calls += 1
+        self._tree.links._links.clear()
+        self._nodes.clear()
+
+    def __getitem__(self, key):
+        self._tree._bpy.calls += 1
+        if isinstance(key, int):
+            return list(self._nodes.values())[key]
+        return self._nodes[key]
+
+    def __iter__(self):
+        return iter(list(self._nodes.values()))
+
+    def __len__(self):
+        return len(self._nodes)
+
+class FakeLink:
+    def __init__(self, from_socket, to_socket):
+        self.from_socket = from_socket
+        self.to_socket = to_socket
+        self.from_node = from_socket.node
+        self.to_node = to_socket.node
+
+class FakeLinks:
+    def __init__(self, tree):
+        self._tree = tree
+        # id(to socket) => FakeLink, an input socket only takes one link
+        self._links = {}
+
+    def new(self, from_socket, to_socket):
+        self._tree._bpy.calls += 1
+        link = self._links[id(to_socket)] = FakeLink(from_socket, to_socket)
+        return link
+
+    def remove(self, link):
+        self._tree._bpy.calls += 1
+        del self._links[id(link.to_socket)]
+
+    def _unlink_node(self, node):
+        for key, link in list(self._links.items()):
+            if link.from_node is node or link.to_node is node:
+                del self._links[key]
+
+    def __iter__(self):
+        return iter(list(self._links.values()))
+
+    def __len__(self):
+        return len(self._links)
+
+class FakeInterfaceSockets:
+    def __init__(self, bpy):
+        self._bpy = bpy
+        self._sockets = []
+
+    def new(self, type, name):
+        self._bpy.calls += 1
+        socket = FakeSocket(None, name)
+        socket.bl_socket_idname = type
+        self._sockets.append(socket)
+        return socket
+
+    def remove(self, socket):
+        self._bpy.calls += 1
+        self._sockets.remove(socket)
+
+    def clear(self):
+        self._bpy.calls += 1
+        self._sockets.clear()
+
+    def __iter__(self):
+        return iter(self._sockets)
+
+    def __len__(self):
+        return len(self._sockets)
+
+class FakeNodeTree:
+    def __init__(self, bpy, name, type):
+        self._bpy = bpy
+        self.name = name
+        self.bl_idname = type
+        self.nodes = FakeNodes(self)
+        self.links = FakeLinks(self)
+        self.inputs = FakeInterfaceSockets(bpy)
+        self.outputs = FakeInterfaceSockets(bpy)
+
+class FakeNodeGroups:
+    def __init__(self, bpy):
+        self._bpy = bpy
+        self._groups = {}
+
+    def new(self, type, name):
+        self._bpy.calls += 1
+        unique, i = name, 1
+        while unique in self._groups:
+            unique = f"{name}.{i:03}"
+            i += 1
+        tree = self._groups[unique] = FakeNodeTree(self._bpy, unique, type)
+        return tree
+
+    def get(self, name, default=None):
+        self._bpy.calls += 1
+        return self._groups.get(name, default)
+
+    def remove(self, tree):
+        self._bpy.calls += 1
+        del self._groups[tree.name]
+
+    def __iter__(self):
+        return iter(list(self._groups.values()))
+
+    def __len__(self):
+        return len(self._groups)
+
+class FakeData:
+    def __init__(self, bpy):
+        self.node_groups = FakeNodeGroups(bpy)
+
+class FakeBpy:
+    def __init__(self):
+        self.calls = 0
+        self.data = FakeData(self)
+
+    def new_tree(self, name="NodeTree", type="ShaderNodeTree"):
+        """
+        A tree that isn't a node group, like a material's node tree
+        """
+        return FakeNodeTree(self, name, type)
@@ -0,0 +1,155 @@
+import marshal
+from hashlib import blake2b
+
+class Node:
+    def __init__(self, name, bl_idname, index=0):
+        self.name = name
+        self.bl_idname = bl_idname
+        # creation order within the graph, unlike the name it never changes
+        self.index = index
+        self.label = ""
+        self.location = [0, 0]
+        # rna property => value, e.g. `operation`
+        self.props = {}
+        # input socket index or name => default value
+        self.defaults = {}
+        # same for outputs, only used by `ShaderNodeValue`
+        self.output_defaults = {}
+
+    def __repr__(self):
+        return f"<{self.bl_idname} `{self.name}`>"
+
+class Socket:
+    """
+    An output socket, every value that isn't a constant is one of these
+    """
+    def __init__(self, node: Node, key=0):
+        self.node = node
+        # socket index or name, group input sockets are named after the arg
+        self.key = key
+
+    def __repr__(self):
+        return f"{self.node}.outputs[{self.key!r}]"
+
+class Link:
+    def __init__(self, from_socket: Socket, to_node: Node, to_key):
+        self.from_socket = from_socket
+        self.to_node = to_node
+        self.to_key = to_key
+
+class Graph:
+    """
+    A node tree as plain python objects
+
+    codegen only ever builds these, turning them into Blender data is
+    left to `apply.BpyApplier` so the compiler can run without `bpy`
+    """
+    def __init__(self, name, tree_type, is_group=True):
+        self.name = name
+        self.tree_type = tree_type
+        # False for the node tree open in the editor, True for the node
+        # groups created for each function
+        self.is_group = is_group
+        # (name, socket type) of the group interface
+        self.inputs = []
+        self.outputs = []
+        # name => Node, in creation order
+        self.nodes = {}
+        # (to node, to socket) => Link, an input takes a single link
+        self.links = {}
+        self._suffixes = {}
+
+    def unique_name(self, name):
+        # same scheme Blender uses, `Math`, `Math.001`, `Math.002`...
+        if name not in self.nodes:
+            return name
+        # remember where the search for each name stopped, otherwise
+        # naming n nodes `Math` is quadratic
+        i = self._suffixes.get(name, 1)
+        while f"{name}.{i:03}" in self.nodes:
+            i += 1
+        self._suffixes[name] = i + 1
+        return f"{name}.{i:03}"
+
+    def new_node(self, bl_idname, name=None):
+        node = Node(self.unique_name(name or bl_idname), bl_idname, len(self.nodes))
+        self.nodes[node.name] = node
+        return node
+
+    def rename(self, node: Node, name):
+        del self.nodes[node.name]
+        node.name = self.unique_name(name)
+        self.nodes[node.name] = node
+
+    def link(self, from_socket: Socket, to_node: Node, to_key):
+        # relinking an input replaces its link like in Blender
+        self.links[(to_node, to_key)] = Link(from_socket, to_node, to_key)
+
+    def shape(self):
+        """
+        A hash of what the graph computes, two functions with the same
+        shape can share a node group. Names, labels and locations don't
+        count and the group interface only counts by position and type,
+        callers link to it by index
+        """
+        interface = {
+            "NodeGroupInput": {name: i for i, (name, _) in enumerate(self.inputs)},
+            "NodeGroupOutput": {name: i for i, (name, _) in enumerate(self.outputs)},
+        }
+        parts = [[typ for _, typ in self.inputs], [typ for _, typ in self.outputs]]
+        for node in sorted(self.nodes.values(), key=lambda node: node.index):
+            defaults = node.defaults
+            if node.bl_idname in interface:
+                keys = interface[node.bl_idname]
+                defaults = {keys.get(k, k): v for k, v in defaults.items()}
+            parts.append((node.index, node.bl_idname, node.props, defaults, node.output_defaults))
+        # codegen links in a fixed order, only the interface keys vary
+        for link in self.links.values():
+            from_socket = link.from_socket
+            from_node = from_socket.node
+            from_key = from_socket.key
+            if from_node.bl_idname in interface:
+                from_key = interface[from_node.bl_idname].get(from_key, from_key)
+            to_key = link.to_key
+            if link.to_node.bl_idname in interface:
+                to_key = interface[link.to_node.bl_idname].get(to_key, to_key)
+            parts.append((from_node.index, from_key, link.to_node.index, to_key))
+        # version 2 is the last one without back references, which
+        # depend on object identity, and it's much faster than formatting
+        return blake2b(marshal.dumps(parts, 2), digest_size=16).hexdigest()
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "tree_type": self.tree_type,
+            "is_group": self.is_group,
+            "inputs": [list(s) for s in self.inputs],
+            "outputs": [list(s) for s in self.outputs],
+            "nodes": [{
+                "name": n.name,
+                "bl_idname": n.bl_idname,
+                "label": n.label,
+                "location": list(n.location),
+                "props": n.props,
+                "defaults": [[k, v] for k, v in n.defaults.items()],
+                "output_defaults": [[k, v] for k, v in n.output_defaults.items()],
+            } for n in self.nodes.values()],
+            "links": [[l.from_socket.node.name, l.from_socket.key, l.to_node.name, l.to_key] for l in self.links.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        graph = cls(data["name"], data["tree_type"], data["is_group"])
+        graph.inputs = [tuple(s) for s in data["inputs"]]
+        graph.outputs = [tuple(s) for s in data["outputs"]]
+        for n in data["nodes"]:
+            node = Node(n["name"], n["bl_idname"], len(graph.nodes))
+            node.label = n["label"]
+            node.location = list(n["location"])
+            node.props = dict(n["props"])
+            node.defaults = {k: v for k, v in n["defaults"]}
+            node.output_defaults = {k: v for k, v in n["output_defaults"]}
+            graph.nodes[node.name] = node
+        for from_node, from_key, to_node, to_key in data["links"]:
+            graph.link(Socket(graph.nodes[from_node], from_key), graph.nodes[to_node], to_key)
+        return graph
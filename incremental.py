@@ -0,0 +1,235 @@
+from hashlib import blake2b
+
+from .ast import FnDef
+from .Lexer import Lexer, TokenStream, edit_range
+from .TokenTypes import TokenKind
+from .compiler import fold
+from .nodegen import NodeGen
+from .graph import Graph
+from .cache import flatten, unflatten
+from .dce import split_items, function_name, reachable
+
+def digest(parts):
+    return blake2b("\0".join(parts).encode(), digest_size=16).hexdigest()
+
+class CachedFunction:
+    def __init__(self, fingerprint, fn: FnDef, graph, shape, specialized=(), groups=None):
+        self.fingerprint = fingerprint
+        # the folded and simplified IR
+        self.fn = fn
+        # the node group calls go to, named after another function if
+        # that one has the same shape
+        self.graph = graph
+        self.shape = shape
+        # groups specialized for constant args that `graph` instances
+        self.specialized = list(specialized)
+        # callee name => the node group its calls went to, `graph`
+        # instances those by name
+        self.groups = groups or {}
+
+    def dump(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "fn": flatten(self.fn),
+            "graph": self.graph.to_dict(),
+            "shape": self.shape,
+            "specialized": [graph.to_dict() for graph in self.specialized],
+            "groups": self.groups,
+        }
+
+    @classmethod
+    def load(cls, data):
+        return cls(data["fingerprint"], unflatten(data["fn"]), Graph.from_dict(data["graph"]), data["shape"],
+                   [Graph.from_dict(graph) for graph in data["specialized"]], data["groups"])
+
+class IncrementalCompiler:
+    """
+    Recompiles only the functions that changed since the last compile
+
+    a function's fingerprint hashes the source text of its tokens, so
+    whitespace and comments don't count, together with the fingerprints
+    of the functions and globals it refers to. A function whose
+    fingerprint didn't change is skipped before it's even parsed and its
+    graph from the last compile is kept, editing a function rebuilds it
+    and everything that calls it
+
+    with a `cache.DiskCache` functions are also looked up by fingerprint
+    on disk, so they survive restarting Blender
+    """
+    def __init__(self, cache=None):
+        self.cache = cache
+        # function name => CachedFunction
+        self.functions = {}
+        # function names, filled in as `generate()` runs
+        self.reused = []
+        self.rebuilt = []
+        # the reused functions that came from the disk cache
+        self.loaded = []
+        # tokens of the last compile's source, an edit only relexes the
+        # part of the source around it
+        self.stream = None
+        # the codegen options of the last compile, part of the disk
+        # cache keys
+        self.options = ()
+
+    def reusable(self, name, cached, calls, nodegen):
+        """
+        A function sharing another one's node group can only be reused
+        if that one was, with the same shape. The same goes for the
+        functions it `calls`, it instances their groups by name and a
+        callee that was rebuilt may now share a group of another shape,
+        or stop sharing one. Even a reused callee's calls may go to
+        another group than when `cached` was built, if a function
+        defined before it took over its shape
+        """
+        if any(fn not in self.reused or nodegen.functions[fn].graph.name != cached.groups.get(fn) for fn in calls):
+            return False
+        group = cached.graph.name
+        if group == name:
+            return True
+        owner = self.functions.get(group)
+        return owner is not None and owner.shape == cached.shape and group in self.reused
+
+    def select(self, content, tokens, fingerprints, callees, nodegen):
+        """
+        Yields the tokens of the globals and of every function that has
+        to be rebuilt, fills `fingerprints` with function name =>
+        fingerprint and `callees` with function name => the functions
+        it may call on the way. Reused functions are defined in
+        `nodegen` so the rebuilt ones can call them
+        """
+        # global name => hash of the items that set it so far
+        env = {}
+        for item in split_items(tokens):
+            text = [content[start:end] for _, _, start, end in item]
+            idents = {value for kind, value, _, _ in item if kind == TokenKind.IDENT}
+            deps = sorted(f"{name}={env[name]}" for name in idents if name in env)
+            name = function_name(item)
+            if name is None:
+                h = digest(text + deps)
+                for ident in idents:
+                    env[ident] = h
+            else:
+                calls = callees[name] = sorted(fn for fn in idents if fn in fingerprints and fn != name)
+                deps += [f"{fn}()={fingerprints[fn]}" for fn in calls]
+                fingerprint = fingerprints[name] = digest(text + deps)
+                cached = self.functions.get(name)
+                if cached is not None and cached.fingerprint == fingerprint and self.reusable(name, cached, calls, nodegen):
+                    self.reused.append(name)
+                    nodegen.define(cached.fn.signature, cached.graph, cached.shape, cached.fn, cached.specialized)
+                    continue
+                if self.cache is not None:
+                    data = self.cache.get(fingerprint, self.options)
+                    if data is not None:
+                        cached = CachedFunction.load(data)
+                        if self.reusable(name, cached, calls, nodegen):
+                            self.functions[name] = cached
+                            self.reused.append(name)
+                            self.loaded.append(name)
+                            nodegen.define(cached.fn.signature, cached.graph, cached.shape, cached.fn, cached.specialized)
+                            continue
+                self.rebuilt.append(name)
+            yield from item
+
+    def record(self, ast, fns):
+        for node in ast:
+            if isinstance(node, FnDef):
+                fns[node.signature.name] = node
+            yield node
+
+    def store(self, name, fingerprints, callees, fns, nodegen):
+        function = nodegen.functions[name]
+        groups = {fn: nodegen.functions[fn].graph.name for fn in callees[name] if fn in nodegen.functions}
+        cached = self.functions[name] = CachedFunction(fingerprints[name], fns[name], function.graph, function.shape,
+                                                       function.specialized, groups)
+        if self.cache is not None:
+            self.cache.put(cached.fingerprint, cached.dump(), self.options)
+
+    def generate(self, content, tree_name, tree_type, legacy_lexer=False, saved=None, dump_tokens=None, dump_ast=None, profiler=None,
+                 entry=None, dead=None, specialize=0):
+        """
+        Like `compiler.generate()` but only yields the graphs of rebuilt
+        functions and of those loaded from disk, reused ones are in
+        `self.functions`. The graph of the edited tree itself is always
+        yielded last
+        """
+        self.reused = []
+        self.rebuilt = []
+        self.loaded = []
+        options = (tree_type, specialize)
+        if options != self.options:
+            # what the functions compiled to depends on these
+            self.functions = {}
+        self.options = options
+        lexer = Lexer(content, legacy=legacy_lexer)
+        stream = None
+        if legacy_lexer:
+            raw = lexer.scan()
+            line_map = lexer.line_map
+        elif self.stream is not None:
+            stream = lexer.relex(self.stream, *edit_range(self.stream.program, content))
+            raw = stream.raw()
+            line_map = stream.line_map
+        else:
+            stream = TokenStream(content)
+            raw = stream.record(lexer.scan())
+            line_map = stream.line_map
+        tokens = raw
+        if profiler:
+            tokens = profiler.stage("lex", tokens, unit="tokens")
+        if dump_tokens:
+            tokens = dump_tokens(tokens, line_map)
+        if entry:
+            # unreachable functions aren't fingerprinted either
+            tokens = reachable(tokens, entry, dead)
+            if profiler:
+                tokens = profiler.stage("reachability", tokens, unit="tokens")
+
+        fingerprints = {}
+        callees = {}
+        fns = {}
+        # the ast is set below, it's built from what `select()` yields
+        nodegen = NodeGen(None, tree_name, tree_type, profiler, specialize)
+        tokens = self.select(content, tokens, fingerprints, callees, nodegen)
+        if profiler:
+            tokens = profiler.stage("fingerprint", tokens, unit="tokens")
+        nodegen.ast = self.record(fold(tokens, line_map, saved, dump_ast, profiler, dead, nodegen.signatures), fns)
+        # names of the groups yielded so far
+        groups = set()
+        loaded = 0
+        for graph in nodegen.generate():
+            # what's in the blend file might be older than the cache,
+            # and the groups loaded have to exist before their callers
+            for name in self.loaded[loaded:]:
+                cached = self.functions[name]
+                for group in cached.specialized + [cached.graph]:
+                    if group.name not in groups:
+                        groups.add(group.name)
+                        yield group
+            loaded = len(self.loaded)
+            if graph.is_group:
+                groups.add(graph.name)
+                if graph.name in nodegen.functions:
+                    # not a specialization
+                    self.store(graph.name, fingerprints, callees, fns, nodegen)
+            else:
+                for name in self.rebuilt:
+                    function = nodegen.functions.get(name)
+                    if function is not None and function.graph.name != name:
+                        # shares another function's group, nothing
+                        # of its own was yielded
+                        self.store(name, fingerprints, callees, fns, nodegen)
+            yield graph
+
+        # the parser might have stopped early, the stream has to
+        # hold every token for the next relex
+        for _ in raw:
+            pass
+        self.stream = stream
+
+        for name in list(self.functions):
+            if name not in fingerprints:
+                # removed from the source
+                del self.functions[name]
+        if self.cache is not None:
+            self.cache.evict()
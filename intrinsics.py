@@ -0,0 +1,221 @@
+import math
+
+from .TokenTypes import TypeKind
+
+F = TypeKind.FLOAT
+V2, V3, V4 = TypeKind.VEC2, TypeKind.VEC3, TypeKind.VEC4
+
+class Intrinsic:
+    """
+    One overload of a builtin, computed by a single native node
+
+    `sockets` are the inputs the args go into and `defaults` fills the
+    inputs the builtin doesn't take an arg for. `sizes` says how a
+    constant arg is stored, 0 for a float socket and the number of
+    components for a vector or color one. `fold` evaluates the builtin
+    on constants
+    """
+    def __init__(self, bl_idname, base, props, result, fold, sockets, sizes, defaults=None, output=0):
+        self.bl_idname = bl_idname
+        self.base = base
+        self.props = props
+        self.result = result
+        self.fold = fold
+        self.sockets = sockets
+        self.sizes = sizes
+        self.defaults = defaults or {}
+        self.output = output
+        # set when registered, `min(vec3, float)`
+        self.signature = None
+
+class Expansion:
+    """
+    An overload without a node of its own, computed by a chain of
+    intrinsics. Each step takes args by index, `None` is the result of
+    the step before
+    """
+    def __init__(self, result, fold, steps):
+        self.result = result
+        self.fold = fold
+        self.steps = steps
+        self.signature = None
+
+# (name, arg types) => Intrinsic or Expansion
+INTRINSICS = {}
+
+def lookup(name, types):
+    """
+    The overload of `name` taking `types`, `None` if there is none.
+    Every scalar is a float to the nodes
+    """
+    key = (name, tuple(typ if typ in {V2, V3, V4} else F for typ in types))
+    return INTRINSICS.get(key)
+
+def register(name, types, intrinsic):
+    names = ", ".join(typ.name.lower() for typ in types)
+    intrinsic.signature = f"{name}({names})"
+    INTRINSICS[(name, types)] = intrinsic
+    return intrinsic
+
+# constant folds, a vector is a tuple and a scalar mixed with one goes to
+# every component
+
+def componentwise(fold):
+    def apply(*args):
+        size = max((len(arg) for arg in args if isinstance(arg, tuple)), default=0)
+        if not size:
+            return fold(*args)
+        args = [arg if isinstance(arg, tuple) else (arg,) * size for arg in args]
+        return tuple(fold(*parts) for parts in zip(*args))
+    return apply
+
+def dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+def length(a):
+    return math.sqrt(dot(a, a))
+
+def normalize(a):
+    n = length(a)
+    return tuple(x / n for x in a) if n else tuple(0.0 for _ in a)
+
+def cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+def reflect(i, n):
+    d = 2.0 * dot(n, i)
+    return tuple(x - d * y for x, y in zip(i, n))
+
+def refract(i, n, eta):
+    d = dot(n, i)
+    k = 1.0 - eta * eta * (1.0 - d * d)
+    if k < 0.0:
+        return tuple(0.0 for _ in i)
+    s = eta * d + math.sqrt(k)
+    return tuple(eta * x - s * y for x, y in zip(i, n))
+
+def faceforward(n, i, nref):
+    return n if dot(nref, i) < 0.0 else tuple(-x for x in n)
+
+def mod(x, y):
+    # glsl's `mod` rounds down, `math.fmod` and Blender's `MODULO` truncate
+    return x - y * math.floor(x / y)
+
+def smoothstep(e0, e1, x):
+    t = min(max((x - e0) / (e1 - e0), 0.0), 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+# name => (Math operation, number of args, fold)
+MATH = {
+    "sin":         ("SINE", 1, math.sin),
+    "cos":         ("COSINE", 1, math.cos),
+    "tan":         ("TANGENT", 1, math.tan),
+    "asin":        ("ARCSINE", 1, math.asin),
+    "acos":        ("ARCCOSINE", 1, math.acos),
+    "atan":        ("ARCTANGENT", 1, math.atan),
+    "sinh":        ("SINH", 1, math.sinh),
+    "cosh":        ("COSH", 1, math.cosh),
+    "tanh":        ("TANH", 1, math.tanh),
+    "exp":         ("EXPONENT", 1, math.exp),
+    "sqrt":        ("SQRT", 1, math.sqrt),
+    "inversesqrt": ("INVERSE_SQRT", 1, lambda x: 1.0 / math.sqrt(x)),
+    "abs":         ("ABSOLUTE", 1, abs),
+    "sign":        ("SIGN", 1, lambda x: float((x > 0) - (x < 0))),
+    "floor":       ("FLOOR", 1, lambda x: float(math.floor(x))),
+    "ceil":        ("CEIL", 1, lambda x: float(math.ceil(x))),
+    "fract":       ("FRACT", 1, lambda x: x - math.floor(x)),
+    "trunc":       ("TRUNC", 1, lambda x: float(math.trunc(x))),
+    "round":       ("ROUND", 1, lambda x: float(math.floor(x + 0.5))),
+    "radians":     ("RADIANS", 1, math.radians),
+    "degrees":     ("DEGREES", 1, math.degrees),
+    "pow":         ("POWER", 2, math.pow),
+    "min":         ("MINIMUM", 2, min),
+    "max":         ("MAXIMUM", 2, max),
+}
+
+# name => (Vector Math operation, fold), applied to every component
+VECTOR_MATH = {
+    "sin":   ("SINE", math.sin),
+    "cos":   ("COSINE", math.cos),
+    "tan":   ("TANGENT", math.tan),
+    "abs":   ("ABSOLUTE", abs),
+    "floor": ("FLOOR", lambda x: float(math.floor(x))),
+    "ceil":  ("CEIL", lambda x: float(math.ceil(x))),
+    "fract": ("FRACTION", lambda x: x - math.floor(x)),
+    "min":   ("MINIMUM", min),
+    "max":   ("MAXIMUM", max),
+}
+
+def math_node(operation, fold, arity, sockets=None, defaults=None):
+    return Intrinsic("ShaderNodeMath", "Math", {"operation": operation}, F, fold,
+                     sockets or list(range(arity)), [0] * arity, defaults)
+
+def vector_node(operation, fold, result, sizes, sockets=None, defaults=None, output=0):
+    return Intrinsic("ShaderNodeVectorMath", "Vector Math", {"operation": operation}, result, fold,
+                     sockets or list(range(len(sizes))), sizes, defaults, output)
+
+for name, (operation, arity, fold) in MATH.items():
+    register(name, (F,) * arity, math_node(operation, fold, arity))
+
+register("atan", (F, F), math_node("ARCTAN2", math.atan2, 2))
+register("log", (F,), math_node("LOGARITHM", math.log, 1, defaults={1: math.e}))
+register("log2", (F,), math_node("LOGARITHM", math.log2, 1, defaults={1: 2.0}))
+register("exp2", (F,), math_node("POWER", lambda x: 2.0 ** x, 1, sockets=[1], defaults={0: 2.0}))
+# `WRAP` is `x - (max - min) * floor((x - min) / (max - min))`
+register("mod", (F, F), math_node("WRAP", mod, 2, defaults={2: 0.0}))
+# `GREATER_THAN` is `x > edge`, only `x == edge` comes out different
+register("step", (F, F), math_node("GREATER_THAN", lambda edge, x: 0.0 if x < edge else 1.0, 2, sockets=[1, 0]))
+
+register("clamp", (F, F, F), Intrinsic(
+    "ShaderNodeClamp", "Clamp", {"clamp_type": "MINMAX"}, F,
+    lambda x, lo, hi: min(max(x, lo), hi), [0, 1, 2], [0, 0, 0]))
+# `Map Range` from [0, 1] is a lerp, it clamps unless told otherwise
+register("mix", (F, F, F), Intrinsic(
+    "ShaderNodeMapRange", "Map Range", {"data_type": "FLOAT", "interpolation_type": "LINEAR", "clamp": False}, F,
+    lambda a, b, t: a + (b - a) * t, [3, 4, 0], [0, 0, 0], {1: 0.0, 2: 1.0}))
+register("smoothstep", (F, F, F), Intrinsic(
+    "ShaderNodeMapRange", "Map Range", {"data_type": "FLOAT", "interpolation_type": "SMOOTHSTEP", "clamp": True}, F,
+    smoothstep,
+    [1, 2, 0], [0, 0, 0], {3: 0.0, 4: 1.0}))
+
+# `Vector Math` is always 3d, a vec2 is a vec3 with a zero z
+for V in (V2, V3):
+    for name, (operation, fold) in VECTOR_MATH.items():
+        fold = componentwise(fold)
+        if name in {"min", "max"}:
+            register(name, (V, V), vector_node(operation, fold, V, [3, 3]))
+            # a float linked into a vector socket is converted by Blender
+            register(name, (V, F), vector_node(operation, fold, V, [3, 3]))
+        else:
+            register(name, (V,), vector_node(operation, fold, V, [3]))
+
+    register("mod", (V, V), vector_node("WRAP", componentwise(mod), V, [3, 3], defaults={2: (0.0, 0.0, 0.0)}))
+    register("mod", (V, F), vector_node("WRAP", componentwise(mod), V, [3, 3], defaults={2: (0.0, 0.0, 0.0)}))
+    register("normalize", (V,), vector_node("NORMALIZE", normalize, V, [3]))
+    # the float results come out of the second socket, `Value`
+    register("length", (V,), vector_node("LENGTH", length, F, [3], output=1))
+    register("distance", (V, V), vector_node("DISTANCE", lambda a, b: length(tuple(x - y for x, y in zip(a, b))),
+                                             F, [3, 3], output=1))
+    register("dot", (V, V), vector_node("DOT_PRODUCT", dot, F, [3, 3], output=1))
+    register("reflect", (V, V), vector_node("REFLECT", reflect, V, [3, 3]))
+    # `eta` is the `Scale` input
+    register("refract", (V, V, F), vector_node("REFRACT", refract, V, [3, 3, 0], sockets=[0, 1, 3]))
+    register("faceforward", (V, V, V), vector_node("FACEFORWARD", faceforward, V, [3, 3, 3]))
+
+    clamp = componentwise(lambda x, lo, hi: min(max(x, lo), hi))
+    for bound in (V, F):
+        register("clamp", (V, bound, bound), Expansion(V, clamp, [
+            (INTRINSICS[("max", (V, bound))], (0, 1)),
+            (INTRINSICS[("min", (V, bound))], (None, 2)),
+        ]))
+
+register("cross", (V3, V3), vector_node("CROSS_PRODUCT", cross, V3, [3, 3]))
+
+# `Mix RGB` mixes colors, the factor is a float
+for V in (V2, V3, V4):
+    register("mix", (V, V, F), Intrinsic(
+        "ShaderNodeMixRGB", "Mix", {"blend_type": "MIX", "use_clamp": False}, V,
+        componentwise(lambda a, b, t: a + (b - a) * t), [1, 2, 0], [4, 4, 0]))
+
+# every builtin name, a call to anything else is a user function
+NAMES = {name for name, _ in INTRINSICS}
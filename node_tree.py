@@ -1,44 +1,116 @@
-import bpy
+from hashlib import blake2b
+
 from .TokenTypes import TokenKind, TypeKind
 from .ast import FnArg
+from .graph import Graph, Socket
+from .intrinsics import Expansion
+from .symbols import Scope
+from .type_infer import is_vector
+
+# Math operations where `a op b == b op a`
+COMMUTATIVE_OPS = {"ADD", "MULTIPLY", "MINIMUM", "MAXIMUM", "COMPARE"}
+
+SOCKET_TYPES = {
+    TypeKind.INT:   "NodeSocketInt",
+    TypeKind.FLOAT: "NodeSocketFloat",
+    TypeKind.BOOL:  "NodeSocketBool",
+    TypeKind.VEC2:  "NodeSocketVector",
+    TypeKind.VEC3:  "NodeSocketVector",
+    TypeKind.VEC4:  "NodeSocketColor",
+}
+
+# tree type => node instancing one of its node groups
+GROUP_NODES = {
+    "ShaderNodeTree":     "ShaderNodeGroup",
+    "GeometryNodeTree":   "GeometryNodeGroup",
+    "CompositorNodeTree": "CompositorNodeGroup",
+    "TextureNodeTree":    "TextureNodeGroup",
+}
+
+def vector_const(value, size=3):
+    """
+    `value` as the default of a vector socket, a scalar goes to every
+    component
+    """
+    if isinstance(value, tuple):
+        return value[:size] + (0.0,) * (size - len(value))
+    return (float(value),) * size
 
 class NodeTree:
-    def __init__(self, name, typ, _global=False):
+    """
+    Builds the `Graph` of one node tree
+
+    variables are resolved through `symbols.Scope`s, the globals for the
+    top level tree and args, then locals, for a function. `parent` is
+    the scope a function's args see, the globals
+    """
+    def __init__(self, name, typ, _global=False, parent=None):
+        self.graph = Graph(name, typ, is_group=not _global)
+        if not _global:
+            self._group_in = self.graph.new_node("NodeGroupInput", "Group Input")
+            self._group_out = self.graph.new_node("NodeGroupOutput", "Group Output")
+        self._inputs = self.graph.inputs
+        self._outputs = self.graph.outputs
         if _global:
-            return
-        self._node_tree = bpy.data.node_groups.new(type=typ, name=name)
-        self._group_in = self._node_tree.nodes.new(type="NodeGroupInput")
-        self._group_out = self._node_tree.nodes.new(type="NodeGroupOutput")
-        self._inputs = self._node_tree.inputs
-        self._outputs = self._node_tree.outputs
+            self.scope = Scope(self, parent)
+        else:
+            # a local may shadow an arg
+            self._arg_scope = Scope(self, parent)
+            self.scope = Scope(self, self._arg_scope)
 
         self._node_loc = [0, 0]
         self._var_loc = [-200, 0]
 
-    def __del__(self):
-        l = self._node_tree.nodes[0].location
+        # (operation, operand key, operand key) => Socket, every value is
+        # only computed once and then shared by all of its users
+        self._values = {}
+        # (group, arg keys...) => group node, same for calls
+        self._calls = {}
+
+    def finish(self):
+        if not self.graph.is_group:
+            return self.graph
+        nodes = list(self.graph.nodes.values())[2:] or [self._group_in]
+        l = nodes[0].location
         self._group_in.location = [l[0] - 400, l[1]]
-        l = self._node_tree.nodes[-1].location
+        l = nodes[-1].location
         self._group_out.location = [l[0] + 200, l[1]]
+        return self.graph
 
     def add_input(self, arg: FnArg):
-        if arg.typ in {TypeKind.VEC2, TypeKind.VEC3, TypeKind.VEC4}:
-            self._inputs.new(type="NodeSocketVector", name=arg.name)
-            if arg.props in {TokenKind.OUT, TokenKind.INOUT}:
-                self._outputs.new(type="NodeSocketVector", name=arg.name)
+        socket_type = SOCKET_TYPES.get(arg.typ, "NodeSocketFloat")
+        if arg.props in {None, TokenKind.IN, TokenKind.INOUT}:
+            self._inputs.append((arg.name, socket_type))
+            self._arg_scope.define(arg.name, Socket(self._group_in, arg.name), arg.typ)
+        if arg.props in {TokenKind.OUT, TokenKind.INOUT}:
+            self._outputs.append((arg.name, socket_type))
+            self._arg_scope.types[arg.name] = arg.typ
+
+    def is_output(self, name):
+        return any(name == output for output, _ in self._outputs)
+
+    def set_output(self, name, value):
+        socket_type = next(typ for output, typ in self._outputs if output == name)
+        if type(value) != Socket and socket_type in {"NodeSocketVector", "NodeSocketColor"}:
+            value = vector_const(value, 4 if socket_type == "NodeSocketColor" else 3)
+        self.link_or_set_at(name, value, self._group_out)
+        # reading the output later gives what was written to it
+        self._arg_scope.names[name] = value
 
     def add_var(self, val):
-        node = self.add_node("ShaderNodeValue")
-        node.location = self._var_loc
+        node = self.add_node("ShaderNodeValue", "Value")
+        node.location = list(self._var_loc)
         self._var_loc[1] -= 100
-        node.outputs[0].default_value = val
-        return node
+        node.output_defaults[0] = val
+        return Socket(node)
 
     def link_or_set_at(self, socket_index, value, node):
-        if issubclass(type(value), bpy.types.Node):
-            self._node_tree.links.new(value.outputs[0], node.inputs[socket_index])
+        if type(value) == Socket:
+            self.graph.link(value, node, socket_index)
+        elif isinstance(value, tuple):
+            node.defaults[socket_index] = value
         else:
-            node.inputs[socket_index].default_value = float(value)
+            node.defaults[socket_index] = float(value)
 
     def node_op_from_token(self, typ):
         match typ:
@@ -46,28 +118,184 @@ class NodeTree:
             case TokenKind.MINUS: return "SUBTRACT"
             case TokenKind.STAR:  return "MULTIPLY"
             case TokenKind.SLASH: return "DIVIDE"
+            case TokenKind.PERCENT: return "MODULO"
+            case TokenKind.LT:    return "LESS_THAN"
+            case TokenKind.GT:    return "GREATER_THAN"
+            case TokenKind.EQ2:   return "COMPARE"
+            # conditions are 0 or 1
+            case TokenKind.AMPERSAND2: return "MULTIPLY"
+            case TokenKind.PIPE2: return "MAXIMUM"
 
-    def set_binary_operation(self, node, op):
-        if node.type == "MATH":
-            node.operation = self.node_op_from_token(op.typ)
-        elif node.type == "VECT_MATH":
-            assert False, "Not implemented"
+    def add_node(self, ty, name=None):
+        return self.graph.new_node(ty, name)
 
-    def add_node(self, ty):
-        node = self._node_tree.nodes.new(type=ty)
-        return node
+    def value_key(self, value):
+        if type(value) == Socket:
+            # ordered by creation so commutative operands are sorted the
+            # same way, and named the same, on every compile
+            key = value.key
+            if value.node is getattr(self, "_group_in", None):
+                # args by position, so functions that only differ in
+                # their arg names come out the same
+                key = next(i for i, (name, _) in enumerate(self._inputs) if name == key)
+            return ("node", value.node.index, str(key))
+        if isinstance(value, tuple):
+            return ("vector", value)
+        return ("const", float(value))
 
     def bin_op(self, left, right, op):
-        node = self.add_node("ShaderNodeMath")
-        node.location = self._node_loc
+        if op.typ == TokenKind.BANGEQ:
+            # there is no `NOT_EQUAL`, `a != b` is `1 - (a == b)`
+            return self.math_op("SUBTRACT", [1.0, self.math_op("COMPARE", [left, right, 0.0])])
+        operation = self.node_op_from_token(op.typ)
+        assert operation is not None, f"`{op.value}` is not supported"
+        if operation == "COMPARE":
+            # the third input is how far apart equal values may be
+            return self.math_op(operation, [left, right, 0.0])
+        return self.math_op(operation, [left, right])
+
+    def math_op(self, operation, args):
+        return self.operation_node("ShaderNodeMath", "Math", operation, args)
+
+    def vector_op(self, operation, args, types):
+        """
+        A `ShaderNodeVectorMath` node, `types` are those of `args` and a
+        scalar arg is broadcast to every component
+        """
+        if operation == "MULTIPLY" and is_vector(types[0]) != is_vector(types[1]):
+            vector, scalar = args if is_vector(types[0]) else reversed(args)
+            if type(vector) != Socket:
+                vector = vector_const(vector)
+            # the fourth input of `SCALE` is the float `Scale` socket
+            return self.operation_node("ShaderNodeVectorMath", "Vector Math", "SCALE", [vector, scalar], [0, 3])
+        # a float linked into a vector socket is converted to a vector of
+        # it by Blender, only constants have to be broadcast here
+        args = [arg if type(arg) == Socket else vector_const(arg) for arg in args]
+        return self.operation_node("ShaderNodeVectorMath", "Vector Math", operation, args)
+
+    def operation_node(self, bl_idname, base, operation, args, sockets=None):
+        """
+        A node of `bl_idname` doing `operation` on `args`, they go into
+        its inputs in order unless `sockets` says where
+        """
+        keys = [self.value_key(arg) for arg in args]
+        if sockets is None and (operation in COMMUTATIVE_OPS or operation == "MULTIPLY_ADD"):
+            # only the two factors of `MULTIPLY_ADD` commute
+            if keys[1] < keys[0]:
+                args[0], args[1] = args[1], args[0]
+                keys[0], keys[1] = keys[1], keys[0]
+
+        key = (bl_idname, operation, *keys)
+        socket = self._values.get(key)
+        if socket is not None:
+            return socket
+
+        node = self.add_node(bl_idname, self.stable_name(base, operation, args))
+        node.location = list(self._node_loc)
+        self._node_loc[0] += 200
+        node.props["operation"] = operation
+        for i, arg in zip(sockets or range(len(args)), args):
+            self.link_or_set_at(i, arg, node)
+        socket = self._values[key] = Socket(node)
+        return socket
+
+    def combine_xyz(self, args):
+        """
+        A vector of up to three scalars, missing components are 0
+        """
+        args = list(args) + [0.0] * (3 - len(args))
+        key = ("ShaderNodeCombineXYZ", *(self.value_key(arg) for arg in args))
+        socket = self._values.get(key)
+        if socket is not None:
+            return socket
+        node = self.add_node("ShaderNodeCombineXYZ", self.stable_name("Combine XYZ", "", args))
+        node.location = list(self._node_loc)
+        self._node_loc[0] += 200
+        for i, arg in enumerate(args):
+            self.link_or_set_at(i, arg, node)
+        socket = self._values[key] = Socket(node)
+        return socket
+
+    def intrinsic(self, intrinsic, args):
+        """
+        The node computing one overload of a builtin, `intrinsics.lookup()`
+        """
+        if isinstance(intrinsic, Expansion):
+            value = None
+            for step, indices in intrinsic.steps:
+                value = self.intrinsic(step, [value if i is None else args[i] for i in indices])
+            return value
+
+        args = [arg if type(arg) == Socket else vector_const(arg, size) if size else float(arg)
+                for arg, size in zip(args, intrinsic.sizes)]
+        key = (intrinsic.signature, *(self.value_key(arg) for arg in args))
+        socket = self._values.get(key)
+        if socket is not None:
+            return socket
+
+        node = self.add_node(intrinsic.bl_idname, self.stable_name(intrinsic.base, intrinsic.signature, args))
+        node.location = list(self._node_loc)
         self._node_loc[0] += 200
-        self.set_binary_operation(node, op)
-        self.link_or_set_at(0, left, node)
-        self.link_or_set_at(1, right, node)
+        node.props.update(intrinsic.props)
+        node.defaults.update(intrinsic.defaults)
+        for i, arg in zip(intrinsic.sockets, args):
+            self.link_or_set_at(i, arg, node)
+        socket = self._values[key] = Socket(node, intrinsic.output)
+        return socket
+
+    def call(self, group, args):
+        """
+        A node instancing the node group `group`, `args` go into its
+        inputs in order and its outputs are read by position
+        """
+        key = (group, *(self.value_key(arg) for arg in args))
+        node = self._calls.get(key)
+        if node is not None:
+            return node
+        node = self.add_node(GROUP_NODES[self.graph.tree_type], self.stable_name(group, "", args))
+        node.location = list(self._node_loc)
+        self._node_loc[0] += 200
+        node.props["node_tree"] = group
+        for i, arg in enumerate(args):
+            self.link_or_set_at(i, arg, node)
+        self._calls[key] = node
         return node
 
+    def stable_name(self, base, operation, args):
+        """
+        Names a node after what it computes, so the same node gets the
+        same name on every compile and `apply.BpyApplier` can keep it
+
+        constants are left out, changing one only updates a default
+        """
+        shape = [operation]
+        for arg in args:
+            if type(arg) == Socket:
+                shape.append(f"{arg.node.name}:{arg.key}")
+            else:
+                shape.append("const")
+        digest = blake2b("|".join(shape).encode(), digest_size=4).hexdigest()
+        return f"{base} {digest}"
+
+    def name_var(self, value, name, typ=None):
+        self.scope.define(name, value, typ)
+        if type(value) != Socket:
+            return
+        node = value.node
+        if not node.label and node.bl_idname != "NodeGroupInput":
+            # only for readability, the value isn't shared with another
+            # variable or an arg
+            self.graph.rename(node, name)
+            node.label = name
+
+    def assign_var(self, name, value):
+        self.scope.assign(name, value)
+
     def find_var(self, name):
-        node = self._node_tree.nodes.get(name)
-        if not node:
-            assert False, f"Undeclared identifier `{name}`"
-        return node
+        value, scope = self.scope.lookup(name)
+        if scope.owner is not self and type(value) == Socket:
+            # a global seen from a function, its node is in another tree
+            node = value.node
+            assert node.bl_idname == "ShaderNodeValue", f"Global `{name}` isn't a constant"
+            return node.output_defaults[0]
+        return value
@@ -1,66 +1,361 @@
-import bpy
+from hashlib import blake2b
 
 from .ast import *
-from .node_tree import NodeTree
+from .node_tree import NodeTree, vector_const
 from .Lexer import Literal
 from .TokenTypes import *
+from .visitor import Visitor, CHILDREN
+from .constant_fold import literal_value, is_user_call
+from .type_infer import TypeInfer, CONSTRUCTORS, is_vector
+from .graph import Socket
+from .intrinsics import lookup
+from .specialize import specialize, BINDABLE
+from .dce import IN_ARGS, OUT_ARGS
 
 from typing import List
 
-class NodeGen:
-    def __init__(self, ast: List[object], bl_context: bpy.types.Context):
-        self.ast = ast
-        self.bl_context = bl_context
+VECTOR_OPS = {
+    TokenKind.PLUS: "ADD",
+    TokenKind.MINUS: "SUBTRACT",
+    TokenKind.STAR: "MULTIPLY",
+    TokenKind.SLASH: "DIVIDE",
+}
+
+# to fold operations on constant vectors
+VECTOR_FOLDS = {
+    "ADD": lambda a, b: a + b,
+    "SUBTRACT": lambda a, b: a - b,
+    "MULTIPLY": lambda a, b: a * b,
+    "DIVIDE": lambda a, b: a / b if b else 0.0,
+}
+
+class Function:
+    """
+    A function calls can be made to, `graph` is the node group it
+    compiled to, possibly shared with other functions of the same shape
 
-        self.tree_type = self.bl_context.space_data.tree_type
-        self.node_tree = self.bl_context.space_data.node_tree
+    `fn` is the folded IR specializations are made from and `specialized`
+    the graphs of the specializations `graph` instances, in the order
+    they have to be created. `consts` is set on a specialization, it's
+    the constant bound to each arg or `None`
+    """
+    def __init__(self, signature: FnSig, graph, shape, fn=None, specialized=(), consts=None):
+        self.signature = signature
+        self.graph = graph
+        self.shape = shape
+        self.fn = fn
+        self.specialized = list(specialized)
+        self.consts = consts
+
+class NodeGen(Visitor):
+    """
+    Generates a `graph.Graph` for the edited node tree and one for
+    every function, nothing here touches `bpy`
+    """
+    def __init__(self, ast: List[object], tree_name, tree_type, profiler=None, specialize=0):
+        self.ast = ast
+        self.tree_type = tree_type
+        self.profiler = profiler
+        # how many groups specialized for constant args a compile may
+        # make, 0 turns specialization off
+        self.specialize = specialize
 
-        self.scope = [NodeTree(self.node_tree.name, self.tree_type, _global=True)]
+        self.scope = [NodeTree(tree_name, self.tree_type, _global=True)]
+        self.types = TypeInfer()
+        # function name => Function
+        self.functions = {}
+        # graph shape => the first graph of that shape
+        self.shapes = {}
+        # function name => FnSig of every function that can be called,
+        # `dce.eliminate()` needs them for the ones that aren't parsed
+        self.signatures = {}
+        # (shape, constant args) => Function, the specializations made so
+        # far and the calls that weren't worth one
+        self.specializations = {}
+        self.specialized = 0
+        # the specialized graphs each function being emitted instances
+        self.needs = [[]]
         self.stop = False
+        self.finished = []
 
     def error(self, msg):
         self.stop = True
         print(msg)
 
-    def clear(self):
-        self.node_tree.nodes.clear()
+    def generate(self):
+        """
+        Yields each function's graph as soon as it's complete and the
+        graph of the edited tree itself last
+
+        `self.ast` may be a generator, so nothing has to wait for the
+        whole file to be parsed
+        """
+        profiler = self.profiler
+        for node in self.ast:
+            if profiler:
+                with profiler.time("nodegen"):
+                    self.emit([node])
+            else:
+                self.emit([node])
+            # nothing refers to the types of an item once it's generated
+            self.types.clear()
+            yield from self.finished
+            self.finished.clear()
+        graph = self.scope[0].finish()
+        if profiler:
+            self.count(graph)
+        yield graph
+
+    def count(self, graph):
+        self.profiler.count("nodes emitted", len(graph.nodes))
+        self.profiler.count("links emitted", len(graph.links))
 
     def start(self):
-        self.clear()
-        self.emit(self.ast)
+        return list(self.generate())
+
+    def define(self, signature: FnSig, graph, shape=None, fn=None, specialized=()):
+        """
+        Makes a function callable, returns False if a group of the same
+        shape already exists and calls go to that instead of `graph`
+        """
+        shape = shape or graph.shape()
+        group = self.shapes.setdefault(shape, graph)
+        self.functions[signature.name] = Function(signature, group, shape, fn, specialized)
+        self.signatures[signature.name] = signature
+        return group is graph
 
     def evaluate(self, node, ntree: NodeTree):
-        ty = type(node)
-        if ty == Binary:
-            return self.binary(node, ntree)
-        elif ty == Literal:
-            return node.value
-        elif ty == Ident:
-            return ntree.find_var(node.name)
+        self.ntree = ntree
+        self.types.infer(node, ntree.scope)
+        return self.visit(node)
+
+    def generic_visit(self, node, *children):
+        assert False, f"{node}: in evaluate()"
+
+    def vector_op(self, operation, node, args):
+        """
+        `operation` on vectors, or on a vector and scalars
+        """
+        types = [self.types[arg] for arg in CHILDREN[type(node)](node)]
+        if operation in VECTOR_FOLDS and not any(type(arg) == Socket for arg in args):
+            size = 4 if TypeKind.VEC4 in types else 3
+            a, b = (vector_const(arg, size) for arg in args)
+            return tuple(VECTOR_FOLDS[operation](x, y) for x, y in zip(a, b))
+        return self.ntree.vector_op(operation, list(args), types)
+
+    def visit_Binary(self, node: Binary, left, right):
+        if is_vector(self.types[node]):
+            operation = VECTOR_OPS.get(node.op.typ)
+            assert operation is not None, f"`{node.op.value}` isn't supported on vectors"
+            return self.vector_op(operation, node, [left, right])
+        return self.ntree.bin_op(left, right, node.op)
+
+    def visit_MathOp(self, node: MathOp, *args):
+        if not is_vector(self.types[node]):
+            return self.ntree.math_op(node.operation, list(args))
+        if node.operation == "POWER":
+            # only whole powers, `ShaderNodeVectorMath` has no `POWER`
+            base, exponent = args
+            assert type(exponent) != Socket and float(exponent).is_integer() and exponent >= 1, \
+                "Vectors can only be raised to constant whole powers"
+            value = base
+            for _ in range(int(exponent) - 1):
+                value = self.ntree.vector_op("MULTIPLY", [value, base], [self.types[node]] * 2)
+            return value
+        return self.vector_op(node.operation, node, list(args))
+
+    def visit_Unary(self, node: Unary, right):
+        assert node.op.typ == TokenKind.MINUS, f"`{node.op.value}` is not implemented"
+        if type(right) != Socket:
+            return tuple(-x for x in right) if isinstance(right, tuple) else -right
+        if is_vector(self.types[node]):
+            return self.ntree.vector_op("MULTIPLY", [right, -1.0], [self.types[node], TypeKind.FLOAT])
+        return self.ntree.math_op("MULTIPLY", [right, -1.0])
+
+    def visit_Call(self, node: Call, *args):
+        typ = CONSTRUCTORS.get(node.name)
+        if typ is None:
+            return self.intrinsic(node, args)
+        if not is_vector(typ):
+            assert len(args) == 1, f"`{node.name}` takes one argument"
+            return args[0]
+        size = 4 if typ == TypeKind.VEC4 else 3
+        if len(args) == 1:
+            if is_vector(self.types[node.args[0]]):
+                return args[0]
+            # `vec3(x)` is `vec3(x, x, x)`
+            args = args * (2 if typ == TypeKind.VEC2 else size)
+        if not any(type(arg) == Socket for arg in args):
+            return vector_const(tuple(float(arg) for arg in args), size)
+        assert typ != TypeKind.VEC4, "`vec4` can only be built from constants"
+        return self.ntree.combine_xyz(args)
+
+    def intrinsic(self, node: Call, args):
+        types = [self.types[arg] for arg in node.args]
+        intrinsic = lookup(node.name, types)
+        if intrinsic is None:
+            assert node.name not in self.functions, f"`{node.name}` has no return value, it can only be called on its own"
+            names = ", ".join(typ.name.lower() for typ in types)
+            assert False, f"No function `{node.name}({names})`"
+        if not any(type(arg) == Socket for arg in args):
+            try:
+                return intrinsic.fold(*args)
+            except (ValueError, ZeroDivisionError, OverflowError):
+                # left to Blender, which has its own answer for these
+                pass
+        return self.ntree.intrinsic(intrinsic, args)
+
+    def call(self, node: Call, ntree: NodeTree):
+        """
+        A call to a user function, an instance of its node group. Out
+        args are assigned the group's outputs
+        """
+        function = self.functions.get(node.name)
+        assert function is not None, f"Unknown function `{node.name}`"
+        sign = function.signature
+        assert len(sign.args) == len(node.args), \
+            f"`{sign.name}` takes {len(sign.args)} arguments but got {len(node.args)}"
+        # the value of every in arg, `None` for out args
+        values = []
+        outputs = []
+        for arg, value in zip(sign.args, node.args):
+            if arg.props in OUT_ARGS:
+                assert type(value) == Ident, f"Out argument `{arg.name}` of `{sign.name}` has to be a variable"
+                outputs.append(value.name)
+            if arg.props in IN_ARGS:
+                value = self.evaluate(value, ntree)
+                if type(value) != Socket and is_vector(arg.typ):
+                    value = vector_const(value, 4 if arg.typ == TypeKind.VEC4 else 3)
+                values.append(value)
+            else:
+                values.append(None)
+        if self.specialize:
+            consts = tuple(value if arg.props in BINDABLE and type(value) != Socket else None
+                           for arg, value in zip(sign.args, values))
+            if any(const is not None for const in consts):
+                function = self.specialization(function, consts)
+        self.need(function)
+        consts = function.consts or (None,) * len(sign.args)
+        inputs = [value for arg, value, const in zip(sign.args, values, consts)
+                  if arg.props in IN_ARGS and const is None]
+        group = ntree.call(function.graph.name, inputs)
+        for i, name in enumerate(outputs):
+            self.store(name, Socket(group, i), ntree)
+
+    def specialization(self, function: Function, consts):
+        """
+        `function` with the constant args `consts` bound, `function`
+        itself if the specialization wouldn't save anything or
+        `self.specialize` groups were already made
+
+        specializations are shared by every call with the same constants
+        to a function of the same shape. A specialization's group is
+        only kept if it has fewer nodes than the generic one, or
+        instances specializations of its own
+        """
+        key = (function.shape, consts)
+        special = self.specializations.get(key)
+        if special is not None:
+            return special
+        if function.fn is None or self.specialized >= self.specialize:
+            return function
+        digest = blake2b(repr(key).encode(), digest_size=4).hexdigest()
+        fn = specialize(function.fn, consts, f"{function.graph.name} {digest}", self.signatures)
+        self.needs.append([])
+        graph = self.function(fn)
+        needs = self.needs.pop()
+        if needs or len(graph.nodes) < len(function.graph.nodes):
+            self.specialized += 1
+            special = Function(fn.signature, graph, graph.shape(), fn, needs, consts)
+            if self.profiler:
+                self.count(graph)
+            self.finished.append(graph)
         else:
-            assert False, f"{node}: in evaluate()"
+            special = function
+        self.specializations[key] = special
+        return special
 
-    def binary(self, node: Binary, ntree: NodeTree):
-        left = self.evaluate(node.left, ntree)
-        right = self.evaluate(node.right, ntree)
+    def need(self, function: Function):
+        """
+        Records that the group being emitted instances `function`
+        """
+        needs = self.needs[-1]
+        for graph in function.specialized + ([function.graph] if function.consts else []):
+            if not any(graph is other for other in needs):
+                needs.append(graph)
+
+    def store(self, name, value, ntree: NodeTree):
+        if ntree.is_output(name):
+            ntree.set_output(name, value)
+        else:
+            ntree.assign_var(name, value)
+
+    def visit_Literal(self, node: Literal):
+        return literal_value(node)
 
-        return ntree.bin_op(left, right, node.op)
+    def visit_Ident(self, node: Ident):
+        return self.ntree.find_var(node.name)
+
+    def binary(self, node: Binary, ntree: NodeTree):
+        return self.evaluate(node, ntree)
 
     def expression(self, node, ntree: NodeTree):
         ty = type(node)
         if ty == Binary:
             return self.binary(node, ntree)
+        elif ty in {MathOp, Unary, Call}:
+            return self.evaluate(node, ntree)
         elif ty == Decl:
+            if type(node.expr) == Ident:
+                # declared without a value
+                if is_vector(node.typ):
+                    value = vector_const(0.0)
+                elif ntree.graph.is_group:
+                    value = 0.0
+                else:
+                    # globals are `Value` nodes, functions read them
+                    # through `NodeTree.find_var()`
+                    value = ntree.add_var(0.0)
+                ntree.name_var(value, node.expr.name, node.typ)
+                return value
             assign = node.expr
-            bl_node = self.expression(assign.init, ntree)
-            bl_node.name = assign.name
-            bl_node.label = assign.name
-            return bl_node
+            self.check_value(assign.init)
+            value = self.expression(assign.init, ntree)
+            ntree.name_var(value, assign.name, node.typ)
+            return value
+        elif ty == Assign:
+            if type(node.init) == Literal:
+                value = float(literal_value(node.init))
+            else:
+                self.check_value(node.init)
+                value = self.expression(node.init, ntree)
+            self.store(node.name, value, ntree)
+            return value
+        elif ty == Ident:
+            return ntree.find_var(node.name)
         elif ty == Literal:
-            return ntree.add_var(float(node.value))
+            if ntree.graph.is_group:
+                # a constant the folder kept because it's passed to a
+                # function, it has to stay one to specialize that call
+                return float(literal_value(node))
+            return ntree.add_var(float(literal_value(node)))
         else:
             self.error(f"{node}: Not implemeneted")
 
+    def function(self, node: FnDef):
+        """
+        Emits the node group of a function
+        """
+        ntree = NodeTree(node.signature.name, self.tree_type, parent=self.scope[0].scope)
+        self.scope.append(ntree)
+        for arg in node.signature.args:
+            ntree.add_input(arg)
+        self.emit(node.body)
+        return self.scope.pop().finish()
+
+    def check_value(self, init):
+        assert not is_user_call(init), f"`{init.name}` has no return value, it can only be called on its own"
+
     def emit(self, nodes: List[object]):
         curr_ntree = self.scope[-1]
         for node in nodes:
@@ -68,12 +363,13 @@ class NodeGen:
                 break
 
             if isinstance(node, FnDef):
-                sign = node.signature
-                ntree = NodeTree(sign.name, self.tree_type)
-                self.scope.append(ntree)
-                for arg in sign.args:
-                    ntree.add_input(arg)
-                self.emit(node.body)
+                self.needs.append([])
+                graph = self.function(node)
+                if self.define(node.signature, graph, fn=node, specialized=self.needs.pop()):
+                    if self.profiler:
+                        self.count(graph)
+                    self.finished.append(graph)
+            elif is_user_call(node):
+                self.call(node, curr_ntree)
             else:
                 self.expression(node, curr_ntree)
-        self.scope.pop()
@@ -0,0 +1,321 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .visitor import walk
+
+# stage slices shorter than this only count towards the totals, one
+# trace event per token would bury everything else
+MIN_EVENT = 50e-6
+
+class Phase:
+    def __init__(self, name, unit="items"):
+        self.name = name
+        # what `items` counts
+        self.unit = unit
+        # time spent in the phase itself, not in the phases it pulls from
+        self.seconds = 0.0
+        # memory allocated on top of what was in use when the phase
+        # started, the most any slice of it needed
+        self.peak = 0
+        self.items = 0
+
+class Profiler:
+    """
+    Collects per-phase timings of a compile
+
+    the compiler's phases are generators feeding each other, pulling an
+    item from the simplifier runs the folder, the parser and the lexer,
+    so every slice subtracts the time of the slices nested in it and a
+    phase's time is only what it spent itself. Memory peaks on the other
+    hand include the nested slices
+
+        profiler = Profiler()
+        with profiler.run():
+            tokens = profiler.stage("lex", lexer.scan())
+            ...
+            with profiler.time("apply"):
+                ...
+
+    `bpy()` wraps the bpy module so the time spent in RNA calls is
+    counted separately from the Python around them. Timing a slice has a
+    cost of its own, it's measured once and taken off the enclosing
+    slices so phases that pull lots of small items aren't inflated
+    """
+    # trace_memory => (seconds per slice, seconds per RNA access) the
+    # bookkeeping adds
+    overhead = {}
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        # name => Phase, in the order they first ran
+        self.phases = {}
+        # nodes emitted, links added... => number
+        self.counts = {}
+        self.bpy_seconds = 0.0
+        self.bpy_calls = 0
+        self.events = []
+        # [nested seconds, nested slices, memory at entry, highest memory
+        # seen] per running slice
+        self._stack = []
+        self._origin = time.perf_counter()
+        self.wall = 0.0
+        self.peak = 0
+
+    def phase(self, name, unit="items"):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase(name, unit)
+        return phase
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def _enter(self):
+        memory = 0
+        if self.trace_memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # the enclosing slice loses its peak to the reset below
+                parent = self._stack[-1]
+                parent[3] = max(parent[3], peak)
+            tracemalloc.reset_peak()
+        self._stack.append([0.0, 0, memory, memory])
+        return time.perf_counter()
+
+    def _exit(self, phase, start, args=None):
+        end = time.perf_counter()
+        elapsed = end - start
+        nested, slices, memory, peak = self._stack.pop()
+        phase.seconds += elapsed - nested - slices * self.overhead.get(self.trace_memory, (0, 0))[0]
+        if self._stack:
+            parent = self._stack[-1]
+            parent[0] += elapsed
+            parent[1] += 1
+        if self.trace_memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            phase.peak = max(phase.peak, peak - memory)
+            if self._stack:
+                parent = self._stack[-1]
+                parent[3] = max(parent[3], peak)
+            tracemalloc.reset_peak()
+        if elapsed >= MIN_EVENT or args:
+            self.events.append((phase.name, start, elapsed, args))
+
+    def calibrate(self):
+        """
+        Measures what timing a slice and proxying an RNA access cost
+        """
+        if self.trace_memory in self.overhead:
+            return
+        n = 2000
+        probe = Profiler(self.trace_memory)
+        with probe.time("outer") as outer:
+            for _ in probe.stage("inner", range(n)):
+                pass
+        per_slice = outer.seconds / (n + 1)
+
+        class Plain:
+            value = 0
+        plain = Plain()
+        proxy = probe.bpy(plain)
+        start = time.perf_counter()
+        for _ in range(n):
+            proxy.value
+        proxied = time.perf_counter() - start - probe.bpy_seconds
+        start = time.perf_counter()
+        for _ in range(n):
+            plain.value
+        direct = time.perf_counter() - start
+        self.overhead[self.trace_memory] = (per_slice, max(proxied - direct, 0) / n)
+
+    def stage(self, name, items, count=None, unit="items"):
+        """
+        Times pulling each item out of `items`, `count(item)` adds to
+        the phase's item count, by default every item counts as one
+        """
+        phase = self.phase(name, unit)
+        items = iter(items)
+        while True:
+            start = self._enter()
+            try:
+                item = next(items)
+            except StopIteration:
+                self._exit(phase, start)
+                return
+            except BaseException:
+                self._exit(phase, start)
+                raise
+            self._exit(phase, start)
+            phase.items += count(item) if count else 1
+            yield item
+
+    @contextmanager
+    def time(self, name, **args):
+        phase = self.phase(name)
+        start = self._enter()
+        try:
+            yield phase
+        finally:
+            self._exit(phase, start, args)
+
+    @contextmanager
+    def run(self):
+        """
+        Wraps the whole compile
+        """
+        if self.trace_memory:
+            tracemalloc.start()
+        self.calibrate()
+        start = time.perf_counter()
+        try:
+            with self.time("compile"):
+                yield self
+        finally:
+            self.wall = time.perf_counter() - start
+            if self.trace_memory:
+                self.peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+    def bpy(self, bpy):
+        return TimedRNA(bpy, self)
+
+    def summary(self):
+        """
+        One line per phase, for the panel
+        """
+        lines = []
+        for phase in self.phases.values():
+            line = f"{phase.name}: {max(phase.seconds, 0) * 1000:.1f}ms"
+            if self.trace_memory:
+                line += f", {phase.peak / 1024 / 1024:.1f} MiB"
+            if phase.items:
+                line += f", {phase.items} {phase.unit}"
+            lines.append(line)
+        if self.bpy_calls:
+            apply = self.phases["apply"].seconds if "apply" in self.phases else 0.0
+            python = apply - self.bpy_seconds - self.bpy_calls * self.overhead.get(self.trace_memory, (0, 0))[1]
+            lines.append(f"bpy: {self.bpy_seconds * 1000:.1f}ms in {self.bpy_calls} calls, "
+                         f"{max(python, 0) * 1000:.1f}ms of python applying")
+        lines.append(", ".join(f"{n} {name}" for name, n in self.counts.items()))
+        return lines
+
+    def chrome_trace(self):
+        """
+        The slices as Chrome trace events, load them in `chrome://tracing`
+        or https://ui.perfetto.dev
+        """
+        events = []
+        for name, start, elapsed, args in self.events:
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": elapsed * 1e6,
+                "pid": 1,
+                "tid": 1,
+            }
+            if args:
+                event["args"] = args
+            events.append(event)
+        totals = {name: {"ms": p.seconds * 1000, "peak_bytes": p.peak, p.unit: p.items}
+                  for name, p in self.phases.items()}
+        events.append({
+            "name": "summary", "ph": "i", "s": "g", "pid": 1, "tid": 1,
+            "ts": events[-1]["ts"] + events[-1]["dur"] if events else 0,
+            "args": {"phases": totals, "counts": self.counts, "bpy_ms": self.bpy_seconds * 1000},
+        })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+def count_nodes(root):
+    return sum(1 for _ in walk(root))
+
+# returned from RNA as they are, there is nothing to time on them
+_PLAIN = (str, int, float, bool, type(None), tuple)
+
+def _unwrap(value):
+    return value._obj if type(value) is TimedRNA else value
+
+class TimedRNA:
+    """
+    Proxies a `bpy` object, adding the time of every attribute access,
+    assignment and call to `profiler.bpy_seconds`. Whatever comes back is
+    wrapped as well
+    """
+    __slots__ = ("_obj", "_profiler")
+
+    def __init__(self, obj, profiler):
+        object.__setattr__(self, "_obj", obj)
+        object.__setattr__(self, "_profiler", profiler)
+
+    def _wrap(self, value):
+        if isinstance(value, _PLAIN):
+            return value
+        return TimedRNA(value, self._profiler)
+
+    def _done(self, start):
+        profiler = self._profiler
+        profiler.bpy_seconds += time.perf_counter() - start
+        profiler.bpy_calls += 1
+
+    # slots are found before `__getattr__` is tried, only the attributes
+    # of the wrapped object end up here
+    def __getattr__(self, name):
+        start = time.perf_counter()
+        try:
+            value = getattr(self._obj, name)
+        finally:
+            self._done(start)
+        return self._wrap(value)
+
+    def __setattr__(self, name, value):
+        value = _unwrap(value)
+        start = time.perf_counter()
+        try:
+            setattr(self._obj, name, value)
+        finally:
+            self._done(start)
+
+    def __call__(self, *args, **kwargs):
+        args = [_unwrap(a) for a in args]
+        kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+        start = time.perf_counter()
+        try:
+            value = self._obj(*args, **kwargs)
+        finally:
+            self._done(start)
+        return self._wrap(value)
+
+    def __getitem__(self, key):
+        start = time.perf_counter()
+        try:
+            value = self._obj[key]
+        finally:
+            self._done(start)
+        return self._wrap(value)
+
+    def __iter__(self):
+        start = time.perf_counter()
+        try:
+            items = list(self._obj)
+        finally:
+            self._done(start)
+        return iter([self._wrap(item) for item in items])
+
+    def __len__(self):
+        start = time.perf_counter()
+        try:
+            return len(self._obj)
+        finally:
+            self._done(start)
+
+    def __eq__(self, other):
+        return self._obj == _unwrap(other)
+
+    def __hash__(self):
+        return hash(self._obj)
@@ -0,0 +1,210 @@
+from .TokenTypes import LiteralKind, TypeKind
+from .ast import *
+from .Lexer import Literal, Token, TokenKind
+from .visitor import Visitor, CHILDREN, walk
+from .constant_fold import literal_value, make_literal
+from .type_infer import TypeInfer, is_vector
+from .symbols import Scope
+
+def simplify(ast, saved=None):
+    """
+    Simplifies each top level item as it's pulled from `ast`
+
+    `saved` is filled with function name => number of nodes removed
+    """
+    simplifier = Simplify()
+    for node in ast:
+        node = simplifier.visit(node)
+        if saved is not None and isinstance(node, FnDef):
+            saved[node.signature.name] = simplifier.saved
+        yield node
+
+# nodes that become a Blender node of their own
+OP_NODES = {Binary, Unary, MathOp, Call}
+
+def count_ops(root):
+    return sum(1 for node in walk(root) if type(node) in OP_NODES)
+
+def is_const(node, value):
+    return type(node) == Literal and node.typ != LiteralKind.BOOL and literal_value(node) == value
+
+def same_expr(a, b):
+    """
+    Structural equality, two reads of the same name in straight line
+    code always see the same value
+    """
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if type(a) != type(b):
+            return False
+        ty = type(a)
+        if ty == Ident:
+            if a.name != b.name:
+                return False
+        elif ty == Literal:
+            if a.typ != b.typ or literal_value(a) != literal_value(b):
+                return False
+        elif ty in {Binary, Unary}:
+            if a.op.typ != b.op.typ:
+                return False
+        elif ty in {MathOp, Call}:
+            name_a = a.operation if ty == MathOp else a.name
+            name_b = b.operation if ty == MathOp else b.name
+            if name_a != name_b or len(a.args) != len(b.args):
+                return False
+        else:
+            return False
+        stack.extend(zip(CHILDREN[ty](a), CHILDREN[ty](b)))
+    return True
+
+def is_star(node):
+    return type(node) == Binary and node.op.typ == TokenKind.STAR
+
+def is_float(node):
+    return type(node) == Literal and node.typ == LiteralKind.FLOAT
+
+class Simplify(Visitor):
+    """
+    Algebraic simplification on folded code
+
+    removes identities and picks the Blender Math operation that does
+    the most work per node:
+
+        x * 1, x / 1, x + 0  => x
+        x * 0                => 0
+        x - x                => 0
+        x / c                => x * (1 / c)
+        a * (1 / b)          => a / b
+        1 / (1 / x)          => x
+        a * b + c            => MULTIPLY_ADD(a, b, c)
+        x * x                => POWER(x, 2)
+        POWER(x, n) * x      => POWER(x, n + 1)
+    """
+    def __init__(self):
+        self.saved = 0
+        # declared types, only to know what kind of zero `x * 0` is
+        self.globals = Scope(None)
+        self.scope = self.globals
+        self.types = TypeInfer()
+
+    def enter_FnDef(self, node):
+        self.before = count_ops(node)
+        self.scope = Scope(None, self.globals)
+        for arg in node.signature.args:
+            self.scope.types[arg.name] = arg.typ
+
+    def visit_FnDef(self, node, *body):
+        node.body = list(body)
+        self.saved = self.before - count_ops(node)
+        self.scope = self.globals
+        return node
+
+    def visit_Decl(self, node, expr):
+        node.expr = expr
+        if isinstance(expr, (Assign, Ident)):
+            self.scope.types[expr.name] = node.typ
+        return node
+
+    def zero(self, node):
+        """
+        A zero of the type of `node`, `node` itself if it has no zero
+        """
+        self.types.clear()
+        typ = self.types.infer(node, self.scope)
+        if typ == TypeKind.FLOAT:
+            return make_literal(LiteralKind.FLOAT, 0.0)
+        if typ == TypeKind.INT:
+            return make_literal(LiteralKind.INT, 0)
+        if is_vector(typ):
+            # `vec3(0.0)` is a constant to codegen
+            return Call(typ.name.lower(), [make_literal(LiteralKind.FLOAT, 0.0)])
+        return node
+
+    def visit_Assign(self, node, init):
+        node.init = init
+        return node
+
+    def visit_Binary(self, node, left, right):
+        node.left = left
+        node.right = right
+        op = node.op.typ
+        if op == TokenKind.PLUS:
+            if is_const(left, 0):
+                return right
+            if is_const(right, 0):
+                return left
+            for a, b in ((left, right), (right, left)):
+                factors = self.as_product(a)
+                if factors:
+                    return MathOp("MULTIPLY_ADD", [*factors, b])
+        elif op == TokenKind.MINUS:
+            if is_const(right, 0):
+                return left
+            if same_expr(left, right):
+                return self.zero(node)
+        elif op == TokenKind.STAR:
+            if is_const(left, 1):
+                return right
+            if is_const(right, 1):
+                return left
+            if is_const(left, 0) or is_const(right, 0):
+                return self.zero(node)
+            for a, b in ((left, right), (right, left)):
+                if self.is_reciprocal(b):
+                    return Binary(Token(TokenKind.SLASH, "/", node.op.loc), a, b.right)
+            if same_expr(left, right):
+                return MathOp("POWER", [left, make_literal(LiteralKind.FLOAT, 2.0)])
+            for a, b in ((left, right), (right, left)):
+                if self.is_power(a) and is_float(a.args[1]) and same_expr(a.args[0], b):
+                    exponent = literal_value(a.args[1]) + 1
+                    return MathOp("POWER", [b, make_literal(LiteralKind.FLOAT, exponent)])
+        elif op == TokenKind.SLASH:
+            if is_const(right, 1):
+                return left
+            if is_const(left, 1) and self.is_reciprocal(right):
+                return right.right
+            if is_float(right) and literal_value(right) != 0:
+                # multiplying is cheaper than dividing and a product
+                # can still be fused into a `MULTIPLY_ADD` later on
+                reciprocal = make_literal(LiteralKind.FLOAT, 1 / literal_value(right))
+                return Binary(Token(TokenKind.STAR, "*", node.op.loc), left, reciprocal)
+        return node
+
+    def is_reciprocal(self, node):
+        return type(node) == Binary and node.op.typ == TokenKind.SLASH and is_const(node.left, 1)
+
+    def is_power(self, node):
+        return type(node) == MathOp and node.operation == "POWER"
+
+    def as_product(self, node):
+        """
+        The two factors of `node` if it's a product, `x * x` is already
+        a `POWER` by the time its sum is simplified
+        """
+        if is_star(node):
+            return [node.left, node.right]
+        if self.is_power(node) and is_const(node.args[1], 2):
+            return [node.args[0], node.args[0]]
+        return None
+
+    def visit_Unary(self, node, right):
+        if type(right) == Unary and right.op.typ == node.op.typ:
+            # -(-x) and !(!x)
+            return right.right
+        node.right = right
+        return node
+
+    def visit_MathOp(self, node, *args):
+        node.args = list(args)
+        return node
+
+    def visit_Call(self, node, *args):
+        node.args = list(args)
+        return node
+
+    def visit_Ident(self, node):
+        return node
+
+    def visit_Literal(self, node):
+        return node
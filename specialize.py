@@ -0,0 +1,45 @@
+from .ast import *
+from .TokenTypes import LiteralKind, TokenKind, TypeKind
+from .cache import flatten, unflatten
+from .constant_fold import constant_fold, make_literal, TYPE_LITERAL_KINDS
+from .simplify import simplify
+from .dce import eliminate
+from .type_infer import is_vector
+
+# args a constant can be bound to, an `inout` arg is written back so it
+# has to stay a socket
+BINDABLE = {None, TokenKind.IN}
+
+VECTOR_SIZES = {TypeKind.VEC2: 2, TypeKind.VEC3: 3, TypeKind.VEC4: 4}
+
+def bind(typ, value):
+    """
+    The expression a constant arg of type `typ` is replaced by, vectors
+    are constructor calls of literals
+    """
+    if is_vector(typ):
+        return Call(typ.name.lower(), [make_literal(LiteralKind.FLOAT, x) for x in value[:VECTOR_SIZES[typ]]])
+    return make_literal(TYPE_LITERAL_KINDS.get(typ, LiteralKind.FLOAT), value)
+
+def specialize(fn: FnDef, consts, name, signatures=None):
+    """
+    A copy of `fn` named `name`, where every arg with a value in `consts`
+    is bound to that constant and dropped from the signature, folded,
+    simplified and cleared of dead stores again
+
+    `consts` has one entry per arg, `None` for the args that stay
+    sockets. `fn` itself isn't touched
+    """
+    clone = unflatten(flatten(fn))
+    sign = fn.signature
+    args = []
+    body = []
+    for arg, value in zip(sign.args, consts):
+        if value is None:
+            args.append(arg)
+        else:
+            # a local now, it may still be assigned to like the arg was
+            body.append(Decl(arg.typ, Assign(arg.name, bind(arg.typ, value))))
+    clone.signature = FnSig(name, args, sign.return_typ)
+    clone.body = body + clone.body
+    return next(eliminate(simplify(constant_fold([clone])), None, signatures))
@@ -0,0 +1,64 @@
+class Scope:
+    """
+    Names visible at one level of a program, globals, a function's args
+    or its locals. Each scope only holds what was declared in it and
+    defers everything else to `parent`, so an inner declaration shadows
+    an outer one
+
+    values are whatever codegen bound the name to, a `graph.Socket` or a
+    constant. `owner` is the `node_tree.NodeTree` the values belong to,
+    a socket can't be used from another node tree
+    """
+    def __init__(self, owner, parent=None):
+        self.owner = owner
+        self.parent = parent
+        # name => value
+        self.names = {}
+        # name => declared TypeKind, an out arg has a type before it has
+        # a value
+        self.types = {}
+
+    def define(self, name, value, typ=None):
+        assert name not in self.names, f"Redefinition of `{name}`"
+        self.names[name] = value
+        if typ is not None:
+            self.types[name] = typ
+
+    def type_of(self, name):
+        scope = self
+        while scope is not None:
+            if name in scope.types:
+                return scope.types[name]
+            if name in scope.names:
+                # declared without a type
+                return None
+            scope = scope.parent
+        return None
+
+    def resolve(self, name):
+        """
+        The scope that declares `name`, `None` if it's undeclared
+        """
+        scope = self
+        while scope is not None:
+            if name in scope.names:
+                return scope
+            scope = scope.parent
+        return None
+
+    def lookup(self, name):
+        """
+        Returns `(value, scope declaring it)`
+        """
+        scope = self.resolve(name)
+        assert scope is not None, f"Undeclared identifier `{name}`"
+        return scope.names[name], scope
+
+    def assign(self, name, value):
+        """
+        Rebinds `name` in the scope that declares it
+        """
+        scope = self.resolve(name)
+        assert scope is not None, f"Undeclared identifier `{name}`"
+        assert scope.owner is self.owner, f"Can't assign `{name}`, it belongs to `{scope.owner.graph.name}`"
+        scope.names[name] = value
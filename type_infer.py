@@ -0,0 +1,109 @@
+from .TokenTypes import LiteralKind, TypeKind
+from .ast import *
+from .Lexer import Literal, TokenKind
+from .visitor import Visitor
+from .intrinsics import lookup
+
+VECTOR_TYPES = {TypeKind.VEC2, TypeKind.VEC3, TypeKind.VEC4}
+
+LITERAL_TYPES = {
+    LiteralKind.INT: TypeKind.INT,
+    LiteralKind.FLOAT: TypeKind.FLOAT,
+    LiteralKind.BOOL: TypeKind.BOOL,
+}
+
+# `vec3(...)` and friends, parsed as calls named after the type
+CONSTRUCTORS = {
+    "float": TypeKind.FLOAT,
+    "int": TypeKind.INT,
+    "bool": TypeKind.BOOL,
+    "vec2": TypeKind.VEC2,
+    "vec3": TypeKind.VEC3,
+    "vec4": TypeKind.VEC4,
+}
+
+BOOL_OPS = {
+    TokenKind.LT, TokenKind.GT, TokenKind.EQ2, TokenKind.BANGEQ,
+    TokenKind.PIPE2, TokenKind.AMPERSAND2,
+}
+
+def is_vector(typ):
+    return typ in VECTOR_TYPES
+
+def broadcast(a, b):
+    """
+    The type of arithmetic on an `a` and a `b`, a scalar is applied to
+    every component of a vector
+    """
+    if is_vector(a):
+        assert not is_vector(b) or a == b, f"Can't mix `{a.name.lower()}` and `{b.name.lower()}`"
+        return a
+    if is_vector(b):
+        return b
+    if TypeKind.FLOAT in {a, b}:
+        return TypeKind.FLOAT
+    return a
+
+class TypeInfer(Visitor):
+    """
+    Works out the `TypeKind` of expressions
+
+    types are looked up in `types` after `infer()`, every node below the
+    expression is annotated too and each node is only ever inferred
+    once. Variable types come from the `symbols.Scope` passed to
+    `infer()`, undeclared names are floats like everything else
+    codegen can't tell apart
+    """
+    def __init__(self):
+        # AST node => TypeKind
+        self.types = {}
+        self.scope = None
+
+    def __getitem__(self, node):
+        return self.types[node]
+
+    def clear(self):
+        self.types.clear()
+
+    def infer(self, node, scope):
+        typ = self.types.get(node)
+        if typ is None:
+            self.scope = scope
+            typ = self.visit(node)
+        return typ
+
+    def annotate(self, node, typ):
+        self.types[node] = typ
+        return typ
+
+    def generic_visit(self, node, *children):
+        return self.annotate(node, TypeKind.FLOAT)
+
+    def visit_Literal(self, node: Literal):
+        return self.annotate(node, LITERAL_TYPES[node.typ])
+
+    def visit_Ident(self, node: Ident):
+        return self.annotate(node, self.scope.type_of(node.name) or TypeKind.FLOAT)
+
+    def visit_Binary(self, node: Binary, left, right):
+        if node.op.typ in BOOL_OPS:
+            return self.annotate(node, TypeKind.BOOL)
+        return self.annotate(node, broadcast(left, right))
+
+    def visit_Unary(self, node: Unary, right):
+        if node.op.typ == TokenKind.BANG:
+            return self.annotate(node, TypeKind.BOOL)
+        return self.annotate(node, right)
+
+    def visit_MathOp(self, node: MathOp, *args):
+        typ = args[0]
+        for arg in args[1:]:
+            typ = broadcast(typ, arg)
+        return self.annotate(node, typ)
+
+    def visit_Call(self, node: Call, *args):
+        typ = CONSTRUCTORS.get(node.name)
+        if typ is None:
+            intrinsic = lookup(node.name, args)
+            typ = intrinsic.result if intrinsic else TypeKind.FLOAT
+        return self.annotate(node, typ)
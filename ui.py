@@ -0,0 +1,557 @@
+try:
+    from beeprint import pp
+except ImportError:
+    print("beeprint is not installed")
+
+import os
+import queue
+import time
+from hashlib import blake2b
+
+import bpy
+from bpy.types import (
+    Panel,
+    Operator,
+    PropertyGroup,
+    WindowManager)
+
+from .Lexer import Token, OffsetLocation
+from .incremental import IncrementalCompiler
+from .cache import DiskCache
+from .artifact import ArtifactError, load_artifact
+from .apply import BpyApplier
+from .background import CompileJob
+from .profiling import Profiler
+from .dce import DeadCode
+
+# (node tree name, tree type) => IncrementalCompiler, keeps the functions
+# of the last compile of each tree
+compilers = {}
+# (node tree name, tree type) => hash of the source it was last compiled from
+compiled = {}
+# cache directory => DiskCache, the hit and miss counts are per session
+caches = {}
+# profiling.Profiler of the last profiled compile
+last_profile = None
+
+def disk_cache(gc):
+    if not gc.use_cache or not gc.cache_dir:
+        return None
+    directory = bpy.path.abspath(gc.cache_dir)
+    cache = caches.setdefault(directory, DiskCache(directory))
+    cache.max_size = gc.cache_size * 1024 * 1024
+    return cache
+
+def dump_tokens(tokens, line_map):
+    for tok in tokens:
+        typ, value, start, _ = tok
+        print(Token(typ, value, OffsetLocation(line_map, start)))
+        yield tok
+
+def dump_ast(ast):
+    print("======= AST dump start =======")
+    for a in ast:
+        if 'pp' in globals():
+            pp(a, indent=4, max_depth=10)
+        else:
+            print(a)
+        yield a
+    print("======== AST dump end ========")
+
+def read_source(gc):
+    if gc.source_type == "INTERNAL":
+        return gc.text_prop.as_string()
+    elif gc.source_type == "EXTERNAL":
+        with open(bpy.path.abspath(gc.filepath), "r") as f:
+            return f.read()
+    return ""
+
+def source_hash(content):
+    return blake2b(content.encode()).hexdigest()
+
+def compile_options(gc, saved, dead):
+    return dict(
+        legacy_lexer=gc.legacy_lexer,
+        saved=saved,
+        entry=gc.entry.strip() or None,
+        specialize=gc.specialize,
+        dead=dead,
+        dump_tokens=dump_tokens if gc.debug_token_output else None,
+        dump_ast=dump_ast if gc.debug_ast_output else None)
+
+def summary(compiler, applier, saved, dead):
+    """
+    What a compile did, as messages for the user
+    """
+    total = len(compiler.reused) + len(compiler.rebuilt)
+    messages = [f"Reused {len(compiler.reused)} of {total} functions, rebuilt: {', '.join(compiler.rebuilt) or 'none'}"]
+    changes = ", ".join(f"{count} {what}" for what, count in applier.changes.items() if count)
+    messages.append(f"Node tree {changes or 'unchanged'}")
+    for name, count in saved.items():
+        if count:
+            messages.append(f"{name}: simplifier saved {count} nodes")
+    if dead.functions:
+        messages.append(f"Removed {len(dead.functions)} unreachable functions: {', '.join(dead.functions)}")
+    for name, (statements, nodes) in dead.removed.items():
+        messages.append(f"{name}: removed {statements} dead statements, {nodes} nodes")
+    return messages
+
+def apply_missing(compiler, applier):
+    for name in compiler.reused:
+        # the node group might have been deleted since
+        cached = compiler.functions[name]
+        for graph in cached.specialized + [cached.graph]:
+            if bpy.data.node_groups.get(graph.name) is None:
+                applier.apply(graph)
+
+def redraw_panels():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "NODE_EDITOR":
+                area.tag_redraw()
+
+class BackgroundCompile:
+    """
+    Applies the graphs of a `background.CompileJob` to `bpy` from
+    `bpy.app.timers`, as many as fit in `CHUNK_TIME` per tick so the UI
+    stays responsive. Starting a compile cancels the previous one and
+    a stale job's graphs are dropped
+    """
+    CHUNK_TIME = 0.02
+    TICK = 0.01
+
+    # the compile that's running or ran last
+    current = None
+
+    def __init__(self, job: CompileJob, key, node_tree, saved, dead, source_hash):
+        self.job = job
+        self.key = key
+        self.source_hash = source_hash
+        self.node_tree = node_tree
+        self.saved = saved
+        self.dead = dead
+        self.applier = BpyApplier(bpy)
+        self.applied = []
+        self.running = False
+        self.status = ""
+
+    def start(self):
+        previous = BackgroundCompile.current
+        if previous is not None and previous.running:
+            previous.cancel()
+        BackgroundCompile.current = self
+        self.running = True
+        self.job.start()
+        bpy.app.timers.register(self.tick, first_interval=0.0)
+
+    def cancel(self):
+        self.job.cancel()
+        self.running = False
+        self.status = "Cancelled"
+        # these groups were updated, but the compiler doesn't know
+        compiler = compilers.get(self.key)
+        if compiler is not None:
+            for name, cached in list(compiler.functions.items()):
+                # functions sharing a group too
+                if cached.graph.name in self.applied:
+                    del compiler.functions[name]
+
+    def tick(self):
+        if not self.running or BackgroundCompile.current is not self:
+            return None
+        job = self.job
+        deadline = time.perf_counter() + self.CHUNK_TIME
+        try:
+            while time.perf_counter() < deadline:
+                # `done` has to be read before the queue is found empty
+                done = job.done
+                try:
+                    graph = job.graphs.get_nowait()
+                except queue.Empty:
+                    if done:
+                        self.finish()
+                        return None
+                    break
+                self.applier.apply(graph, None if graph.is_group else self.node_tree)
+                if graph.is_group:
+                    self.applied.append(graph.name)
+        except ReferenceError:
+            # the node tree was deleted
+            self.cancel()
+            return None
+        finally:
+            redraw_panels()
+        return self.TICK
+
+    def finish(self):
+        self.running = False
+        if self.job.error is not None:
+            self.cancel()
+            self.status = f"Failed: {self.job.error}"
+            return
+        compiler = compilers[self.key] = self.job.compiler
+        compiled[self.key] = self.source_hash
+        apply_missing(compiler, self.applier)
+        messages = summary(compiler, self.applier, self.saved, self.dead)
+        for message in messages:
+            print(message)
+        self.status = messages[0]
+
+    def progress(self):
+        return f"Compiling {self.job.progress:.0%}, applied {len(self.applied)} functions"
+
+def start_background(gc, content, node_tree, tree_type):
+    key = (node_tree.name, tree_type)
+    compiler = compilers.setdefault(key, IncrementalCompiler())
+    compiler.cache = disk_cache(gc)
+    saved = {}
+    dead = DeadCode()
+    job = CompileJob(compiler, content, node_tree.name, tree_type, **compile_options(gc, saved, dead))
+    BackgroundCompile(job, key, node_tree, saved, dead, source_hash(content)).start()
+
+class LiveWatcher:
+    """
+    Recompiles in the background once the source stops changing
+
+    every `POLL` seconds a cheap signature of the source is taken, the
+    file's mtime and size or the Text's dirty state, length and cursor.
+    Once it stayed the same for `DEBOUNCE` seconds after a change the
+    source is read, and only compiled if its hash differs from the last
+    compile's
+    """
+    POLL = 0.25
+    DEBOUNCE = 0.5
+
+    current = None
+
+    def __init__(self, node_tree, tree_type):
+        self.node_tree = node_tree
+        self.tree_type = tree_type
+        self.signature = None
+        self.changed_at = None
+
+    @classmethod
+    def start(cls, node_tree, tree_type):
+        cls.current = cls(node_tree, tree_type)
+        bpy.app.timers.register(cls.current.tick, first_interval=0.0)
+
+    @classmethod
+    def stop(cls):
+        cls.current = None
+
+    def source_signature(self, gc):
+        if gc.source_type == "EXTERNAL":
+            try:
+                st = os.stat(bpy.path.abspath(gc.filepath))
+            except OSError:
+                return None
+            return (st.st_mtime_ns, st.st_size)
+        text = gc.text_prop
+        if text is None:
+            return None
+        # anything short of the content misses edits that keep the line
+        # count and cursor, like `from_string()` or an undo
+        return (text.name, source_hash(text.as_string()))
+
+    def tick(self):
+        if LiveWatcher.current is not self:
+            return None
+        gc = bpy.context.window_manager.glsl_compiler
+        try:
+            signature = self.source_signature(gc)
+            now = time.monotonic()
+            if signature != self.signature:
+                self.signature = signature
+                self.changed_at = now
+            elif self.changed_at is not None and now - self.changed_at >= self.DEBOUNCE:
+                self.changed_at = None
+                self.recompile(gc)
+        except ReferenceError:
+            # the node tree or the Text was deleted
+            LiveWatcher.stop()
+            return None
+        return self.POLL
+
+    def recompile(self, gc):
+        try:
+            content = read_source(gc)
+        except OSError:
+            return
+        h = source_hash(content)
+        if compiled.get((self.node_tree.name, self.tree_type)) == h:
+            return
+        current = BackgroundCompile.current
+        if current is not None and current.running and current.source_hash == h:
+            return
+        start_background(gc, content, self.node_tree, self.tree_type)
+
+def live_update(self, context):
+    node_tree = getattr(context.space_data, "node_tree", None)
+    if self.live and node_tree is not None:
+        LiveWatcher.start(node_tree, context.space_data.tree_type)
+    else:
+        LiveWatcher.stop()
+
+class COM_PT_Panel(Panel):
+    bl_idname = "COM_PT_Panel"
+    bl_label = "GLSL Compiler"
+    bl_region_type = "UI"
+    bl_space_type = "NODE_EDITOR"
+    bl_category = "GLSL Compiler"
+
+    @classmethod
+    def poll(cls, context):
+        return hasattr(context.space_data, "tree_type") and \
+            context.space_data.tree_type in {'ShaderNodeTree', 'GeometryNodeTree'} and \
+            context.space_data.node_tree
+
+    def draw(self, context):
+        gc = context.window_manager.glsl_compiler
+        layout = self.layout
+        layout.use_property_decorate = False
+        row = layout.row(align=True)
+        row.prop(gc, "source_type", expand=True)
+        if gc.source_type == "EXTERNAL":
+            row = layout.row(align=True)
+            row = row.column()
+            row.prop(gc, "filepath", text="")
+        elif gc.source_type == "INTERNAL":
+            row = layout.row(align=True)
+            row = row.column()
+            row.prop(gc, "text_prop", text="")
+        row = row.column()
+        row.operator("glsl_compiler.compile")
+        row.operator("glsl_compiler.compile_background")
+        row.prop(gc, "live")
+        row.prop(gc, "entry")
+        row.prop(gc, "specialize")
+        job = BackgroundCompile.current
+        if job is not None:
+            col = layout.column(align=True)
+            if job.running:
+                col.label(text=job.progress())
+                col.operator("glsl_compiler.cancel")
+            elif job.status:
+                col.label(text=job.status)
+
+        row = layout.row(align=True)
+        row.prop(gc, "debug_ast_output")
+        row.prop(gc, "debug_token_output")
+        row = layout.row(align=True)
+        row.prop(gc, "legacy_lexer")
+        row = layout.row(align=True)
+        row.prop(gc, "profile")
+        if gc.profile:
+            row.prop(gc, "profile_memory")
+            if last_profile is not None:
+                col = layout.box().column(align=True)
+                col.label(text=f"Last compile: {last_profile.wall * 1000:.1f}ms")
+                for line in last_profile.summary():
+                    col.label(text=line)
+                col.operator("glsl_compiler.export_trace")
+
+        row = layout.row(align=True)
+        row.prop(gc, "use_cache")
+        if gc.use_cache:
+            col = layout.column(align=True)
+            col.prop(gc, "cache_dir", text="")
+            col.prop(gc, "cache_size")
+            cache = disk_cache(gc)
+            if cache is not None:
+                col.label(text=f"Cache: {cache.hits} hits, {cache.misses} misses")
+
+        col = layout.column(align=True)
+        col.prop(gc, "artifact_path", text="")
+        col.prop(gc, "artifact_groups", text="Groups")
+        col.operator("glsl_compiler.load_artifact")
+
+class COM_OT_compile(Operator):
+    bl_idname = "glsl_compiler.compile"
+    bl_label = "Compile"
+
+    @classmethod
+    def poll(cls, context):
+        gc = context.window_manager.glsl_compiler
+        return \
+            (gc.source_type == "INTERNAL" and gc.text_prop) or \
+            (gc.source_type == "EXTERNAL" and gc.filepath)
+
+    def execute(self, context):
+        global last_profile
+        gc = context.window_manager.glsl_compiler
+        content = read_source(gc)
+        current = BackgroundCompile.current
+        if current is not None and current.running:
+            # this compile makes its result stale
+            current.cancel()
+
+        node_tree = context.space_data.node_tree
+        tree_type = context.space_data.tree_type
+        compiler = compilers.setdefault((node_tree.name, tree_type), IncrementalCompiler())
+        compiler.cache = disk_cache(gc)
+        saved = {}
+        dead = DeadCode()
+        profiler = Profiler(gc.profile_memory) if gc.profile else None
+        if profiler:
+            with profiler.run():
+                applier = self.compile(compiler, content, node_tree, tree_type, saved, dead, gc, profiler)
+            profiler.counts.update(applier.changes)
+            last_profile = profiler
+        else:
+            applier = self.compile(compiler, content, node_tree, tree_type, saved, dead, gc)
+        compiled[(node_tree.name, tree_type)] = source_hash(content)
+        for message in summary(compiler, applier, saved, dead):
+            self.report({'INFO'}, message)
+        return {'FINISHED'}
+
+    def compile(self, compiler, content, node_tree, tree_type, saved, dead, gc, profiler=None):
+        graphs = compiler.generate(content, node_tree.name, tree_type, profiler=profiler, **compile_options(gc, saved, dead))
+        # each function's node group is built as soon as it's generated
+        if profiler:
+            applier = BpyApplier(profiler.bpy(bpy))
+            node_tree = profiler.bpy(node_tree)
+        else:
+            applier = BpyApplier(bpy)
+        for graph in graphs:
+            if profiler:
+                with profiler.time("apply", graph=graph.name):
+                    applier.apply(graph, None if graph.is_group else node_tree)
+            else:
+                applier.apply(graph, None if graph.is_group else node_tree)
+        apply_missing(compiler, applier)
+        return applier
+
+class COM_OT_compile_background(COM_OT_compile):
+    """
+    Compiles in a worker thread and applies the result a bit at a time
+    """
+    bl_idname = "glsl_compiler.compile_background"
+    bl_label = "Compile in Background"
+
+    def execute(self, context):
+        gc = context.window_manager.glsl_compiler
+        content = read_source(gc)
+
+        start_background(gc, content, context.space_data.node_tree, context.space_data.tree_type)
+        return {'FINISHED'}
+
+class COM_OT_load_artifact(Operator):
+    """
+    Builds node groups from an artifact written by the command line
+    compiler, without compiling anything
+    """
+    bl_idname = "glsl_compiler.load_artifact"
+    bl_label = "Load Artifact"
+
+    @classmethod
+    def poll(cls, context):
+        return context.window_manager.glsl_compiler.artifact_path
+
+    def execute(self, context):
+        gc = context.window_manager.glsl_compiler
+        node_tree = context.space_data.node_tree
+        names = [name.strip() for name in gc.artifact_groups.split(",") if name.strip()]
+        try:
+            built = load_artifact(bpy, bpy.path.abspath(gc.artifact_path), names, None if names else node_tree)
+        except (OSError, KeyError, ArtifactError) as e:
+            self.report({'ERROR'}, f"Could not load the artifact: {e}")
+            return {'CANCELLED'}
+        # the tree and its groups no longer match the last compile
+        key = (node_tree.name, context.space_data.tree_type)
+        compiled.pop(key, None)
+        compilers.pop(key, None)
+        self.report({'INFO'}, f"Loaded {len(built)} node trees")
+        return {'FINISHED'}
+
+class COM_OT_export_trace(Operator):
+    """
+    Writes the last profiled compile as Chrome trace JSON
+    """
+    bl_idname = "glsl_compiler.export_trace"
+    bl_label = "Export Trace"
+
+    filepath: bpy.props.StringProperty(subtype="FILE_PATH", default="glsl_compiler_trace.json")
+
+    @classmethod
+    def poll(cls, context):
+        return last_profile is not None
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        try:
+            last_profile.write_chrome_trace(bpy.path.abspath(self.filepath))
+        except OSError as e:
+            self.report({'ERROR'}, f"Could not write the trace: {e}")
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Trace written to {self.filepath}")
+        return {'FINISHED'}
+
+class COM_OT_cancel(Operator):
+    bl_idname = "glsl_compiler.cancel"
+    bl_label = "Cancel"
+
+    @classmethod
+    def poll(cls, context):
+        return BackgroundCompile.current is not None and BackgroundCompile.current.running
+
+    def execute(self, context):
+        BackgroundCompile.current.cancel()
+        return {'FINISHED'}
+
+class GLSLCompiler(PropertyGroup):
+    source_type: bpy.props.EnumProperty(name="Source Type", items=[
+        ("INTERNAL", "Internal", ""),
+        ("EXTERNAL", "External", ""),
+    ])
+
+    text_prop: bpy.props.PointerProperty(type=bpy.types.Text)
+    filepath: bpy.props.StringProperty(name="Source file", subtype="FILE_PATH", default="")
+
+    debug_ast_output: bpy.props.BoolProperty(name="AST output", default=False)
+    debug_token_output: bpy.props.BoolProperty(name="Token output", default=False)
+    legacy_lexer: bpy.props.BoolProperty(name="Legacy lexer", default=False)
+    profile: bpy.props.BoolProperty(name="Profile", description="Time each phase of the compile", default=False)
+    profile_memory: bpy.props.BoolProperty(
+        name="Memory", description="Also trace allocations, makes the compile several times slower", default=False)
+    live: bpy.props.BoolProperty(name="Live", description="Recompile whenever the source changes", default=False, update=live_update)
+    entry: bpy.props.StringProperty(
+        name="Entry", description="Only compile the functions this one calls, everything if empty", default="")
+    specialize: bpy.props.IntProperty(
+        name="Specializations", description="How many node groups may be specialized for constant arguments, 0 turns it off",
+        default=0, min=0)
+
+    use_cache: bpy.props.BoolProperty(name="Disk cache", default=False)
+    cache_dir: bpy.props.StringProperty(name="Cache directory", subtype="DIR_PATH", default="")
+    cache_size: bpy.props.IntProperty(name="Cache size (MB)", default=256, min=1)
+
+    artifact_path: bpy.props.StringProperty(name="Artifact", subtype="FILE_PATH", default="")
+    artifact_groups: bpy.props.StringProperty(
+        name="Groups", description="Comma separated node groups to load, everything if empty", default="")
+
+classes = [
+    COM_PT_Panel,
+    GLSLCompiler,
+    COM_OT_compile,
+    COM_OT_compile_background,
+    COM_OT_cancel,
+    COM_OT_load_artifact,
+    COM_OT_export_trace,
+]
+
+def register():
+    for cls in classes:
+        bpy.utils.register_class(cls)
+
+    WindowManager.glsl_compiler = bpy.props.PointerProperty(type=GLSLCompiler)
+
+def unregister():
+    LiveWatcher.stop()
+    if BackgroundCompile.current is not None and BackgroundCompile.current.running:
+        BackgroundCompile.current.cancel()
+    del WindowManager.glsl_compiler
+
+    for cls in classes:
+        bpy.utils.unregister_class(cls)
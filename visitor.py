@@ -0,0 +1,103 @@
+from .ast import *
+from .Lexer import Literal
+
+# how to reach the children of every node class, in evaluation order
+CHILDREN = {
+    FnDef:   lambda node: node.body,
+    Decl:    lambda node: (node.expr,),
+    Assign:  lambda node: (node.init,),
+    Binary:  lambda node: (node.left, node.right),
+    Unary:   lambda node: (node.right,),
+    Call:    lambda node: node.args,
+    MathOp:  lambda node: node.args,
+    Ident:   lambda node: (),
+    Literal: lambda node: (),
+}
+
+# the attributes `CHILDREN` reads, a single name holds a list of children
+CHILD_FIELDS = {
+    FnDef:   "body",
+    Decl:    ("expr",),
+    Assign:  ("init",),
+    Binary:  ("left", "right"),
+    Unary:   ("right",),
+    Call:    "args",
+    MathOp:  "args",
+    Ident:   (),
+    Literal: (),
+}
+
+def set_children(node, children):
+    fields = CHILD_FIELDS[type(node)]
+    if isinstance(fields, str):
+        setattr(node, fields, list(children))
+    else:
+        for field, child in zip(fields, children):
+            setattr(node, field, child)
+
+def walk(root):
+    """
+    Yields `root` and every node below it, in pre-order
+    """
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        if type(node) in CHILDREN:
+            stack.extend(reversed(CHILDREN[type(node)](node)))
+
+class Visitor:
+    """
+    Post-order AST visitor that keeps its own stack
+
+    subclasses define `visit_<NodeClass>(self, node, *children)` which
+    receives the node and the results of visiting its children, and
+    optionally `enter_<NodeClass>(self, node)` which runs before the
+    children are visited. The methods are collected into per class
+    dispatch tables once when the subclass is created. Nothing here
+    recurses, so the depth of an expression is only bounded by memory
+    """
+    dispatch = {}
+    enter_dispatch = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch = {}
+        cls.enter_dispatch = {}
+        for node_cls in CHILDREN:
+            method = getattr(cls, f"visit_{node_cls.__name__}", None)
+            if method is not None:
+                cls.dispatch[node_cls] = method
+            method = getattr(cls, f"enter_{node_cls.__name__}", None)
+            if method is not None:
+                cls.enter_dispatch[node_cls] = method
+
+    def generic_visit(self, node, *children):
+        assert False, f"{node}: no visitor for `{type(node).__name__}`"
+
+    def visit(self, root):
+        dispatch = self.dispatch
+        enter_dispatch = self.enter_dispatch
+        generic = type(self).generic_visit
+        # entries are `(node, n)`, `n` is None until the children of
+        # `node` have been pushed and is their count afterwards
+        stack = [(root, None)]
+        results = []
+        while stack:
+            node, n = stack.pop()
+            if n is None:
+                if type(node) in enter_dispatch:
+                    enter_dispatch[type(node)](self, node)
+                children = CHILDREN[type(node)](node) if type(node) in CHILDREN else ()
+                stack.append((node, len(children)))
+                for child in reversed(children):
+                    stack.append((child, None))
+                continue
+
+            if n:
+                args = results[-n:]
+                del results[-n:]
+            else:
+                args = ()
+            results.append(dispatch.get(type(node), generic)(self, node, *args))
+        return results[0]